@@ -0,0 +1,171 @@
+"""
+A process-wide cache of directory listings.
+
+Every dired view, the jump command, and the directory prompt read listings through this
+module so a directory is only scanned once until it changes.  Entries are validated against
+the directory's mtime and inode and evicted least-recently-used when the cache grows past
+the limits in the settings.
+"""
+
+import os, threading, time
+from collections import OrderedDict
+from os.path import normpath, normcase
+
+import sublime
+
+from .scan import scan, Scanner
+from .render import sort_entries
+
+ENTRY_BYTES = 120
+# A rough estimate of the memory used by an Entry excluding its name.  Only used to enforce
+# the memory cap, so it doesn't need to be exact.
+
+RACY_SECONDS = 2
+# A directory modified this recently may be modified again without its mtime changing
+# (coarse timestamps on NFS, FAT, etc.), so listings for it are not cached.
+
+
+def normalize(path):
+    """
+    Returns the key used for `path` in the cache.
+    """
+    return normcase(normpath(path))
+
+
+def stamp(path):
+    """
+    Returns the value a cached listing of `path` is validated against.
+    """
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_ino)
+
+
+class ListingCache:
+    """
+    An LRU cache of directory listings.  It is safe to use from multiple threads.
+    """
+    def __init__(self, max_entries=500000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+
+        self.lock  = threading.Lock()
+        self.items = OrderedDict()
+        # Map from normalized path to (stamp, entries, size) ordered from least to most
+        # recently used.
+
+        self.entries = 0
+        self.bytes   = 0
+        # Totals for everything in `items`.
+
+    def get(self, path, current):
+        """
+        Returns the cached entries for `path` if they were read when the directory had the
+        stamp `current`, otherwise None.
+        """
+        with self.lock:
+            item = self.items.get(path)
+            if item is None:
+                return None
+            if item[0] != current:
+                self._remove(path)
+                return None
+            self.items.move_to_end(path)
+            return item[1]
+
+    def put(self, path, current, entries):
+        size = sum(ENTRY_BYTES + len(entry.name) for entry in entries)
+        if len(entries) > self.max_entries or size > self.max_bytes:
+            return
+
+        with self.lock:
+            self._remove(path)
+            self.items[path] = (current, entries, size)
+            self.entries += len(entries)
+            self.bytes   += size
+
+            while self.entries > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.items)))
+
+    def invalidate(self, path):
+        """
+        Drops the listing of `path` so the directory is read again, e.g. for an explicit
+        refresh.
+        """
+        with self.lock:
+            self._remove(normalize(path))
+
+    def _remove(self, path):
+        item = self.items.pop(path, None)
+        if item:
+            self.entries -= len(item[1])
+            self.bytes   -= item[2]
+
+
+listings = ListingCache()
+
+
+def load(path, cancelled=None):
+    """
+    Returns the entries for the directory `path` (which must already be normalized) in display
+    order, scanning it only if the cached listing is missing or out of date, and the stamp of
+    the directory they were read at.
+    """
+    current = stamp(path)
+    entries = listings.get(path, current)
+    if entries is None:
+        started = time.time()
+        entries = sort_entries(scan(path, cancelled))
+        if started - current[0] / 1e9 > RACY_SECONDS:
+            listings.put(path, current, entries)
+    return entries, current
+
+
+def listing(path):
+    """
+    Returns the entries for the directory `path` in display order, reading it if necessary.
+    Raises OSError if it cannot be read.
+
+    The returned list is shared, so it must not be modified.
+    """
+    return load(normalize(path))[0]
+
+
+scanner = Scanner(load)
+
+
+def fetch(key, path, callback, stat=False):
+    """
+    Reads the directory `path` on a worker thread and calls `callback(entries, error, stamp)`
+    on the main thread, where `stamp` is the directory's stamp when it was read.  Callers
+    asking for the same directory at the same time share one scan.
+
+    key
+        Identifies the caller, normally a view id.  Only the most recent request for a key is
+        answered.
+
+    stat
+        Also read the lstat data of the entries that don't have it yet, for display modes that
+        show or sort by sizes and times.
+    """
+    scanner.start(key, normalize(path), callback, stat)
+
+
+def cancel(key):
+    """
+    Abandons the reads requested with `key`, and with tuple keys starting with it.  Their
+    callbacks are not called.
+    """
+    scanner.cancel(key)
+
+
+def _configure():
+    settings = sublime.load_settings('dired.sublime-settings')
+    listings.max_entries = settings.get('listing_cache_max_entries', 500000)
+    listings.max_bytes   = settings.get('listing_cache_max_mb', 64) * 1024 * 1024
+
+
+def plugin_loaded():
+    settings = sublime.load_settings('dired.sublime-settings')
+    settings.clear_on_change('dired.cache')
+    settings.add_on_change('dired.cache', _configure)
+    _configure()
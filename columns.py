@@ -0,0 +1,136 @@
+"""
+The long (ls -l style) listing format.
+
+Permissions, link count, size, and modification time are formatted from the lstat data cached
+on each entry (see scan.stat_entries), which is read on a worker thread along with the listing
+or, when the format is turned on, before the view is re-rendered.  Owner and group names and
+symlink targets are slower to find, so lines are first rendered with numeric ids and no
+targets, and `resolve` looks them up on a worker thread, visible rows first, and then calls
+back to re-render the changed lines.
+"""
+
+import os, stat, time
+
+import sublime
+
+try:
+    import pwd, grp
+except ImportError:
+    # Windows has neither.  Numeric ids are shown instead.
+    pwd = grp = None
+
+NAME_WIDTH = 8
+# The width of the owner and group columns.  Longer names are truncated so the file names
+# always start in the same column.
+
+SIX_MONTHS = 182 * 86400
+# Like ls, times older than this (or in the future) show the year instead of the time.
+
+owners = {}
+groups = {}
+# Maps from uid and gid to the names found by `resolve`.
+
+_modes = {}
+_times = {}
+# Formatted permissions by st_mode and times by minute.  Files in a directory tend to share
+# both, and formatting them is most of the cost of a line.
+
+
+def line(entry, label=None):
+    """
+    Returns the long format line for `entry`.  `label` is the text shown for its name, by
+    default entry.text.
+    """
+    label = label or entry.text
+    st = entry.st
+    if not st:
+        return '{:<10} {:>3} {:<8} {:<8} {:>6} {:<12} {}'.format('?', '?', '?', '?', '?', '?', label)
+
+    owner = owners.get(st.st_uid) or str(st.st_uid)
+    group = groups.get(st.st_gid) or str(st.st_gid)
+
+    mode = _modes.get(st.st_mode)
+    if mode is None:
+        mode = _modes[st.st_mode] = stat.filemode(st.st_mode)
+
+    text = '{} {:>3} {:<8} {:<8} {:>6} {} {}'.format(
+        mode, st.st_nlink, owner[:NAME_WIDTH], group[:NAME_WIDTH],
+        size(st.st_size), mtime(st.st_mtime), label)
+    if entry.target:
+        # Like ls, show "link -> target" even for links to directories.
+        text = text.rstrip(os.sep) + ' -> ' + entry.target
+    return text
+
+
+def size(n):
+    """
+    Formats a size in at most 6 characters like `ls -lh`.
+    """
+    if n < 1024:
+        return str(n)
+    for unit in 'KMGTP':
+        n /= 1024.0
+        if n < 1024 or unit == 'P':
+            break
+    return (n < 10) and '{:.1f}{}'.format(n, unit) or '{:.0f}{}'.format(n, unit)
+
+
+def mtime(t):
+    minute = int(t) // 60
+    text = _times.get(minute)
+    if text is None:
+        now = time.time()
+        if now - SIX_MONTHS < t <= now + 60:
+            text = time.strftime('%b %d %H:%M', time.localtime(t))
+        else:
+            text = time.strftime('%b %d  %Y', time.localtime(t))
+        if len(_times) > 100000:
+            _times.clear()
+        _times[minute] = text
+    return text
+
+
+def unresolved(entry):
+    """
+    Returns True if `entry` has a column that `resolve` has not filled in yet.
+    """
+    st = entry.st
+    if not st:
+        return False
+    if entry.is_link and entry.target is None:
+        return True
+    return (pwd is not None) and (st.st_uid not in owners or st.st_gid not in groups)
+
+
+def resolve(path, entries, callback):
+    """
+    Looks up the owners, groups, and symlink targets for `entries`, in order, on a worker
+    thread, then calls `callback()` on the main thread.  Put the visible entries first.
+    """
+    entries = [ entry for entry in entries if unresolved(entry) ]
+    if not entries:
+        return
+
+    def _run():
+        for entry in entries:
+            st = entry.st
+            if entry.is_link and entry.target is None:
+                try:
+                    entry.target = os.readlink(os.path.join(path, entry.name))
+                except OSError:
+                    entry.target = ''
+            if pwd is None:
+                continue
+            if st.st_uid not in owners:
+                try:
+                    owners[st.st_uid] = pwd.getpwuid(st.st_uid).pw_name
+                except KeyError:
+                    owners[st.st_uid] = str(st.st_uid)
+            if st.st_gid not in groups:
+                try:
+                    groups[st.st_gid] = grp.getgrgid(st.st_gid).gr_name
+                except KeyError:
+                    groups[st.st_gid] = str(st.st_gid)
+        sublime.set_timeout(callback, 0)
+
+    sublime.set_timeout_async(_run, 0)
@@ -1,12 +1,25 @@
 
-import re
+from bisect import bisect_right
 from sublime import Region
 
-RE_FILE = re.compile(r'^([^\\// ].*)$')
+from . import model
+
+
+def show_marks(view):
+    """
+    Updates the view's 'marked' regions from its model.
+    """
+    m = model.get(view)
+    rows = m and m.marked_rows()
+    if not rows:
+        view.erase_regions('marked')
+        return
+
+    base = view.text_point(2, 0)
+    offsets = m.offsets()
+    regions = [ Region(base + offsets[row], base + offsets[row + 1] - 1) for row in rows ]
+    view.add_regions('marked', regions, 'dired.marked', 'dot', 0)
 
-def first(seq, pred):
-    # I can't comprehend how this isn't built-in.
-    return next((item for item in seq if pred(item)), None)
 
 class DiredBaseCommand:
     """
@@ -63,29 +76,64 @@ class DiredBaseCommand:
         """
         Returns a list of all filenames in the view.
         """
-        return [ RE_FILE.match(self.view.substr(l)).group(1) for l in self.view.lines(self.fileregion()) ]
+        m = model.get(self.view)
+        if not m:
+            return []
+        return [ entry.text for entry in m.rendered() ]
 
 
     def get_selected(self):
         """
         Returns a list of selected filenames.
         """
+        m = model.get(self.view)
+        if not m:
+            return []
+        rendered = m.rendered()
         names = set()
-        fileregion = self.fileregion()
-        for sel in self.view.sel():
-            lines = self.view.lines(sel)
-            for line in lines:
-                if fileregion.contains(line):
-                    text = self.view.substr(line)
-                    names.add(RE_FILE.match(text).group(1))
+        for first, last in self._rows(self.view.sel()):
+            names.update(entry.text for entry in rendered[first:last+1])
         return sorted(list(names))
 
     def get_marked(self):
-        lines = []
-        if self.filecount():
-            for region in self.view.get_regions('marked'):
-                lines.extend(self.view.lines(region))
-        return [ RE_FILE.match(self.view.substr(line)).group(1) for line in lines ]
+        m = model.get(self.view)
+        if not m:
+            return []
+        return [ m.entries[i].text for i in sorted(m.marked) ]
+
+    def _rows(self, regions):
+        """
+        Returns the rendered entries covered by `regions` as a sorted list of non-overlapping
+        (first, last) row tuples.  Rows are indexes into the model's rendered entries.
+
+        The rows are found by binary search over the model's line offsets, so this makes no
+        API calls per line.
+        """
+        m = model.get(self.view)
+        count = self.filecount()
+        if not m or not count:
+            return []
+
+        base = self.view.text_point(2, 0)
+        offsets = m.offsets()
+
+        ranges = []
+        for region in regions:
+            if region.end() < base:
+                continue
+            first = max(0, bisect_right(offsets, region.begin() - base) - 1)
+            last  = min(count - 1, bisect_right(offsets, region.end() - base) - 1)
+            if first <= last:
+                ranges.append((first, last))
+        ranges.sort()
+
+        merged = []
+        for first, last in ranges:
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(last, merged[-1][1]))
+            else:
+                merged.append((first, last))
+        return merged
 
     def _mark(self, mark=None, regions=None):
         """
@@ -97,42 +145,64 @@ class DiredBaseCommand:
 
         regions
             Either a single region or a sequence of regions.  Only files within the region will
-            be modified.
+            be modified.  If None, all files are modified including those in a large directory
+            that are not rendered.
         """
-        # Allow the user to pass a single region or a collection (like view.sel()).
-        if isinstance(regions, Region):
-            regions = [ regions ]
-
-        filergn = self.fileregion()
+        m = model.get(self.view)
+        if not m:
+            return
 
-        # We can't update regions for a key, only replace, so we need to record the existing
-        # marks.
-        previous = self.view.get_regions('marked')
-        marked = { RE_FILE.match(self.view.substr(r)).group(1): r for r in previous }
+        if regions is None:
+            indexes = range(len(m.entries))
+        else:
+            # Allow the user to pass a single region or a collection (like view.sel()).
+            if isinstance(regions, Region):
+                regions = [ regions ]
+            indexes = ( m.start + row for (first, last) in self._rows(regions)
+                        for row in range(first, last + 1) )
+
+        # Marks are kept in the model, so only the affected entries are touched.
+        marked = m.marked
+        for i in indexes:
+            if mark not in (True, False):
+                newmark = mark(i in marked, m.entries[i].text)
+                assert newmark in (True, False), 'Invalid mark: {}'.format(newmark)
+            else:
+                newmark = mark
+
+            if newmark:
+                marked.add(i)
+            else:
+                marked.discard(i)
+
+        show_marks(self.view)
+
+    def _mark_entries(self, test, mark=True):
+        """
+        Sets the mark of every entry in the model for which `test(entry)` returns True,
+        including entries that are not rendered.  Other marks are left alone.
+        """
+        m = model.get(self.view)
+        if not m:
+            return 0
 
-        for region in regions:
-            for line in self.view.lines(region):
-                if filergn.contains(line):
-                    text = self.view.substr(line)
-                    filename = RE_FILE.match(text).group(1)
-
-                    if mark not in (True, False):
-                        newmark = mark(filename in marked, filename)
-                        assert newmark in (True, False), 'Invalid mark: {}'.format(newmark)
-                    else:
-                        newmark = mark
-
-                    if newmark:
-                        marked[filename] = line
-                    else:
-                        marked.pop(filename, None)
-
-        if marked:
-            r = sorted(list(marked.values()), key=lambda region: region.a)
-            self.view.add_regions('marked', r, 'dired.marked', 'dot', 0)
+        matches = [ i for (i, entry) in enumerate(m.entries) if test(entry) ]
+        if mark:
+            m.marked.update(matches)
         else:
-            self.view.erase_regions('marked')
+            m.marked.difference_update(matches)
+
+        show_marks(self.view)
+        return len(matches)
 
+    def clear_marks(self):
+        """
+        Unmarks all files.
+        """
+        m = model.get(self.view)
+        if m:
+            m.marked.clear()
+        self.view.erase_regions('marked')
 
     def set_help_text(self, edit, text):
         # There is only 1 help text area, but the scope selector will skip blank lines
@@ -1,12 +1,19 @@
 
 import sublime
 from sublime import Region
-from sublime_plugin import WindowCommand, TextCommand
-import os, shutil, tempfile
+from sublime_plugin import WindowCommand, TextCommand, EventListener, ViewEventListener
+import os
 from os.path import basename, dirname, isdir, exists, join, isabs, normpath, normcase
 
-from .common import RE_FILE, DiredBaseCommand
-from . import prompt
+from .common import DiredBaseCommand, show_marks
+from .cache import fetch, listings, cancel as cancel_fetch
+from .watch import watcher
+from .render import diff, line_key, sort_entries
+from .scan import stat_async
+from .query import compile as compile_query, QueryError
+from .find import Search
+from . import model, order
+from . import prompt, jobs, fileops, rename, columns, du, preview, registry, history
 from .show import show
 
 # Each dired view stores its path in its local settings as 'dired_path'.
@@ -16,19 +23,30 @@ NORMAL_HELP = """\
  t = toggle all marks
  U = unmark all
  *. = mark by file extension
+ %m = mark by query
+ %u = unmark by query
 
  Enter/o = Open file / view directory
+ i = expand/collapse directory inline
  R = rename
+ %r = rename by pattern
  M = move
+ C = copy
  D = delete
  cd = create directory
  cf = create file
 
  u = up to parent directory
+ [ = back to the previous directory
+ ] = forward
  g = goto directory
  p = move to previous file
  n = move to next file
  r = refresh view
+ ( = toggle long format
+ s = change sort order
+ S = toggle disk usage
+ F = find files below this directory
 
  B = Goto Anywhere(goto any directory, bookmark or project dir) 
  ab = add to bookmark
@@ -37,6 +55,7 @@ NORMAL_HELP = """\
  ra = remove from project
 
  P = toggle preview mode on/off
+ K = cancel background job
 
  j = jump to file/dir name """
 
@@ -50,6 +69,90 @@ def reuse_view():
     return sublime.load_settings('dired.sublime-settings').get('reuse_view', False)
 
 
+def render_listing(view, edit, m, index=None):
+    """
+    Replaces the contents of the view with the rendered part of the model `m`.
+
+    index
+        The index of the entry to put the cursor on.  Defaults to the first rendered entry.
+    """
+    f = m.lines()
+
+    header = footer = ''
+    if m.virtual:
+        header = ' entries {}-{} of {}'.format(m.start + 1, m.end, len(m.entries))
+        if m.end < len(m.entries):
+            footer = ' {} more entries below'.format(len(m.entries) - m.end)
+    if m.usage is not None:
+        header = du.header(m) + (header and ',' + header)
+    if view.settings().get('dired_find'):
+        header = find_header(view, m)
+
+    text = [ m.path, header ]
+    text.extend(f)
+    text.append(footer)
+    text.append(NORMAL_HELP)
+
+    view.erase(edit, Region(0, view.size()))
+    view.insert(edit, 0, '\n'.join(text))
+    view.set_syntax_file('Packages/dired/dired.tmLanguage')
+    view.settings().set('dired_count', len(f))
+    show_marks(view)
+
+    # Place the cursor.
+    if f:
+        row = (index is None) and 2 or (index - m.start + 2)
+        pt = view.text_point(row, 0)
+        view.sel().clear()
+        view.sel().add(Region(pt, pt))
+        view.show(pt)
+
+    if m.long:
+        resolve_columns(view, m)
+
+
+def resolve_columns(view, m):
+    """
+    Fills in the slow long format columns of the rendered entries in the background, starting
+    with the visible ones.
+    """
+    rendered = m.rendered()
+    visible = view.visible_region()
+    first = max(0, view.rowcol(visible.begin())[0] - 2)
+    last  = max(first, view.rowcol(visible.end())[0] - 1)
+
+    update = lambda: view.run_command('dired_update_columns')
+    columns.resolve(m.path, rendered[first:last], update)
+    columns.resolve(m.path, rendered[:first] + rendered[last:], update)
+
+
+def long_format(view):
+    """
+    Returns True if the view should use the long format.
+    """
+    default = sublime.load_settings('dired.sublime-settings').get('long_format', False)
+    return view.settings().get('dired_long', default)
+
+
+def sort_order(view):
+    """
+    Returns the (mode, reverse, dirs_first) the view is sorted in.  See order.py.
+    """
+    settings = sublime.load_settings('dired.sublime-settings')
+    return (view.settings().get('dired_sort', settings.get('sort_by', 'name')),
+            view.settings().get('dired_sort_reverse', False),
+            view.settings().get('dired_dirs_first', settings.get('dirs_first', False)))
+
+
+def needs_stat(view):
+    """
+    Returns True if the view shows or sorts by sizes and times, so its listings should be read
+    with their lstat data.
+    """
+    return (long_format(view) or bool(view.settings().get('dired_du')) or
+            sort_order(view)[0] in order.NEEDS_STAT)
+
+
 class DiredCommand(WindowCommand):
     """
     Prompt for a directory to display and display it.
@@ -77,75 +180,681 @@ class DiredCommand(WindowCommand):
         # Use the user's home directory.
         return os.path.expanduser('~')
 
+
+SCANNING_TEXT = ' scanning…'
+
+JUMP_CHOICES = 5
+# The number of best matches shown in the status bar while jumping to a name.
+
+FIND_INTERVAL = 500
+# Milliseconds between updates of a find results view while the search runs.
+
+PATCH_LIMIT = 1000
+# Refreshes that change more than this many lines (or half of the listing, if larger) replace
+# the whole listing instead of patching it.
+
+scan_results = {}
+# Map from view id to (path, entries, error, stamp, subdirs) for a completed scan waiting to be
+# rendered.  `stamp` is the directory's cache.stamp when it was read and `subdirs` maps the
+# relative path of each subdirectory to expand to its entries.
+
+
 class DiredRefreshCommand(TextCommand, DiredBaseCommand):
     """
     Populates or repopulates a dired view.
+
+    The listing is read through the shared cache on a worker thread and dired_render fills in
+    the view when it is ready.  Starting another refresh before then abandons the earlier
+    request.
     """
-    def run(self, edit, goto=None):
+    def run(self, edit, goto=None, reload=False):
         """
         goto
             Optional filename to put the cursor on.
+
+        reload
+            Read the directory again even if the cached listing is still valid.  The cache is
+            only validated by the directory's mtime, which doesn't change when a file in it
+            is written to, so this is needed to see new sizes and times.
         """
         path = self.path
+        view = self.view
+
+        if reload:
+            listings.invalidate(path)
+            m = model.get(view)
+            if m and m.path == path:
+                for name in m.expanded:
+                    listings.invalidate(join(path, name))
+
+        query = view.settings().get('dired_find')
+        if query:
+            # Refreshing find results runs the search again.
+            view.run_command('dired_find', { 'query': query })
+            return
 
-        names = os.listdir(path)
-        f = []
-        for name in names:
-            if isdir(join(path, name)):
-                name += os.sep
-            f.append(name)
+        if view.settings().get('dired_shown_path') != path:
+            # This is a different directory than the view is displaying, so the current
+            # contents are meaningless.  Show a placeholder until the scan is done.
+            view.set_read_only(False)
+            view.erase(edit, Region(0, view.size()))
+            view.insert(edit, 0, '\n'.join([ path, '', SCANNING_TEXT ]))
+            view.set_syntax_file('Packages/dired/dired.tmLanguage')
+            view.settings().set('dired_count', 0)
+            view.settings().set('dired_shown_path', path)
+            view.erase_regions('marked')
+            view.set_read_only(True)
+        else:
+            sublime.status_message('Scanning {}'.format(path))
+
+        # Subdirectories expanded in the view are read again too, at the same time, and the
+        # view is rendered when everything has been read.
+        m = model.get(view)
+        expanded = []
+        if m and m.path == path and not view.settings().get('dired_du'):
+            expanded = sorted(m.expanded)
+        subdirs = {}
+        waiting = [ len(expanded) + 1 ]
+        stat = needs_stat(view)
+
+        def _done():
+            waiting[0] -= 1
+            if not waiting[0]:
+                view.run_command('dired_render', { 'goto': goto })
+
+        def _on_scan(entries, error, stamp):
+            scan_results[view.id()] = (path, entries, error, stamp, subdirs)
+            _done()
+
+        def _on_subdir(name):
+            def _on_scan(entries, error, stamp):
+                if entries is not None:
+                    subdirs[name] = entries
+                _done()
+            return _on_scan
+
+        fetch(view.id(), path, _on_scan, stat)
+        for name in expanded:
+            fetch((view.id(), 'refresh', name), join(path, name), _on_subdir(name), stat)
+
+
+class DiredRenderCommand(TextCommand, DiredBaseCommand):
+    """
+    An internal command that fills in a dired view from a completed scan.
+    """
+    def run(self, edit, goto=None, walk=True):
+        """
+        walk
+            In disk usage mode, start counting the directory if its totals aren't cached.
+        """
+        result = scan_results.pop(self.view.id(), None)
+        if not result or self.view.settings().get('dired_rename_mode'):
+            # Rendering would throw away the names being edited.  Rename mode ends with a
+            # refresh, which scans again.
+            return
 
-        marked = set(self.get_marked())
+        path, entries, error, stamp, subdirs = result
+        if path != self.path:
+            # The view was pointed at another directory while scanning.
+            return
 
-        text = [ path ]
-        text.append('')
-        text.extend(f)
-        text.append('')
-        text.append(NORMAL_HELP)
+        if error:
+            sublime.status_message('dired: {}'.format(error))
+            entries = []
+        else:
+            watcher.watch(self.view.id(), path)
 
-        self.view.set_read_only(False)
+        old = model.get(self.view)
+        current = self._current()
+
+        m = model.Model(path, entries, stamp)
+        m.long = long_format(self.view)
+        final = True
+        if self.view.settings().get('dired_du'):
+            final = du.apply(m)
+        else:
+            m.sort(*sort_order(self.view))
+            if not model.wants_virtual(len(entries)):
+                # Expand the same subdirectories again.  Parents sort before their children.
+                for name in sorted(subdirs):
+                    m.expand(name, subdirs[name])
+        if old:
+            m.inherit_marks(old)
+        model.put(self.view, m)
+
+        if not final and walk:
+            view = self.view
+            du.start(path, view.id(), lambda: view.run_command('dired_du_update'))
+
+        if model.wants_virtual(len(entries)) or m.usage is not None:
+            # Only render a page of entries around the cursor.  Disk usage listings are
+            # re-sorted as the sizes change, so they are always rendered from scratch.
+            index = m.find((goto or current or '').rstrip(os.sep)) or 0
+            if model.wants_virtual(len(entries)):
+                m.start, m.end = m.window(index)
+            self.view.set_read_only(False)
+            render_listing(self.view, edit, m, index)
+            self.view.set_read_only(True)
+            start_watch_scrolling(self.view)
+            return
+
+        # If the view is already displaying this directory, only change what is different so
+        # marks, the selection, and the scroll position on unchanged lines stay put.  The
+        # listings are compared as (name, line) pairs so the long format can be patched too.
+        # Only listings in name order can be merged, so other orders are rendered in full.
+        count = self.filecount()
+        hunks = None
+        if count and m.sorted and not (old and old.virtual):
+            if old:
+                items = list(zip([ entry.text for entry in old.entries ], old.lines()))
+            elif not m.long:
+                # A view restored from the last session.
+                items = [ (line, line) for line in self.view.substr(self.fileregion()).split('\n') ]
+            else:
+                items = None
+            if items is not None:
+                new = list(zip([ entry.text for entry in m.entries ], m.lines()))
+                hunks = diff(items, new, limit=max(PATCH_LIMIT, count // 2), key=item_key)
 
-        self.view.erase(edit, Region(0, self.view.size()))
-        self.view.insert(edit, 0, '\n'.join(text))
-        self.view.set_syntax_file('Packages/dired/dired.tmLanguage')
-        self.view.settings().set('dired_count', len(f))
-
-        if marked:
-            # Even if we have the same filenames, they may have moved so we have to manually
-            # find them again.
-            regions = []
-            for line in self.view.lines(self.fileregion()):
-                filename = RE_FILE.match(self.view.substr(line)).group(1)
-                if filename in marked:
-                    regions.append(line)
-            self.view.add_regions('marked', regions, 'dired.marked', 'dot', 0)
+        self.view.set_read_only(False)
+        if hunks is None:
+            render_listing(self.view, edit, m, m.find((current or '').rstrip(os.sep)))
         else:
-            self.view.erase_regions('marked')
+            patch_listing(self.view, edit, hunks)
+            if m.long:
+                resolve_columns(self.view, m)
+        self.view.set_read_only(True)
+
+        if goto and entries:
+            index = m.find(goto.rstrip(os.sep))
+            if index is not None:
+                pt = self.view.text_point(index + 2, 0)
+                self.view.sel().clear()
+                self.view.sel().add(Region(pt, pt))
+                self.view.show(pt)
+
+    def _current(self):
+        """
+        Returns the name on the line with the cursor or None.
+        """
+        if not len(self.view.sel()):
+            return None
+        rows = self._rows([ self.view.sel()[0] ])
+        return rows and model.get(self.view).rendered()[rows[0][0]].text or None
+
+
+def patch_listing(view, edit, hunks):
+    """
+    Applies the hunks returned by diff() to the file lines in the view.  The hunks contain
+    (name, line) pairs.
+    """
+    # Lines added or removed above the first visible line would scroll the view, so
+    # remember where it is and compensate afterwards.
+    x, y = view.viewport_position()
+    top = view.rowcol(view.layout_to_text((x, y)))[0] - 2
+    shift = 0
+
+    count = view.settings().get('dired_count', 0)
+    for start, end, items in reversed(hunks):
+        region = Region(view.text_point(start + 2, 0), view.text_point(end + 2, 0))
+        view.replace(edit, region, ''.join(line + '\n' for (name, line) in items))
+        count += len(items) - (end - start)
+        if end <= top:
+            shift += len(items) - (end - start)
+    view.settings().set('dired_count', count)
+
+    # Marks on deleted lines are left behind as empty regions and entries may have moved,
+    # so recreate them from the model.
+    show_marks(view)
+
+    if shift:
+        view.set_viewport_position((x, y + shift * view.line_height()), False)
+
+
+class DiredDuUpdateCommand(TextCommand, DiredBaseCommand):
+    """
+    An internal command that re-renders a view in disk usage mode with the latest totals.
+    """
+    def run(self, edit):
+        m = model.get(self.view)
+        if not m or m.path != self.path or not self.view.settings().get('dired_du'):
+            return
+        if self.view.settings().get('dired_rename_mode'):
+            return
+        scan_results[self.view.id()] = (m.path, list(m.entries), None, m.stamp, {})
+        self.view.run_command('dired_render', { 'walk': False })
+
+
+class DiredDiskUsageCommand(TextCommand, DiredBaseCommand):
+    """
+    Turns disk usage mode on or off.
+    """
+    def run(self, edit):
+        on = not self.view.settings().get('dired_du', False)
+        self.view.settings().set('dired_du', on)
+        self.view.run_command('dired_refresh')
+
+
+def item_key(item):
+    return line_key(item[0])
+
+
+class DiredUpdateColumnsCommand(TextCommand, DiredBaseCommand):
+    """
+    An internal command that re-renders the lines whose long format columns were filled in
+    by columns.resolve.
+    """
+    def run(self, edit):
+        m = model.get(self.view)
+        if not m or not m.long or self.view.settings().get('dired_rename_mode'):
+            return
+
+        old = m.lines()
+        m.version += 1
+        new = m.lines()
+        if len(old) != len(new) or len(new) != self.filecount():
+            return
+
+        # Replace each run of changed lines with a single call.  Usually it is all of them.
+        runs = []
+        for row in range(len(new)):
+            if old[row] != new[row]:
+                if runs and runs[-1][1] == row:
+                    runs[-1][1] = row + 1
+                else:
+                    runs.append([ row, row + 1 ])
+
+        self.view.set_read_only(False)
+        for start, end in reversed(runs):
+            region = Region(self.view.text_point(start + 2, 0), self.view.text_point(end + 1, 0))
+            region = Region(region.a, self.view.line(region.b).b)
+            self.view.replace(edit, region, '\n'.join(new[start:end]))
+        self.view.set_read_only(True)
+        show_marks(self.view)
+
+
+class DiredToggleLongCommand(TextCommand, DiredBaseCommand):
+    """
+    Switches between listing names only and the long (ls -l style) format.
+    """
+    def run(self, edit, long=None):
+        """
+        long
+            True or False to turn the long format on or off instead of toggling it.
+        """
+        view = self.view
+        m = model.get(view)
+        if not m:
+            return
+
+        on = (long is None) and not long_format(view) or bool(long)
+        view.settings().set('dired_long', on)
+        search = searches.get(view.id())
+        if search:
+            # Stat the matches still to come too.
+            search.stat = on
+
+        if on and m.unstated():
+            # Read the sizes and times in the background, then show them, unless the format
+            # has been turned off again by then.
+            def _on_stat():
+                if view.settings().get('dired_long'):
+                    view.run_command('dired_toggle_long', { 'long': True })
+            sublime.status_message('Reading file sizes and times')
+            stat_async(m.path, m.unstated(), _on_stat)
+            return
+
+        m.long = on
+        rows = self._rows(self.view.sel())
+        index = rows and (m.start + rows[0][0]) or None
+
+        self.view.set_read_only(False)
+        render_listing(self.view, edit, m, index)
+        self.view.set_read_only(True)
+
+
+expand_results = {}
+# Map from (view id, relative path) to (path, entries, error) for a subdirectory listing read
+# by dired_expand.
+
+
+class DiredExpandCommand(TextCommand, DiredBaseCommand):
+    """
+    Expands the selected directories inline, showing their entries indented below them, or
+    collapses them if they are already expanded.
+
+    Listings are read in the background.  Collapsing only hides the entries, so expanding
+    the directory again doesn't read it again.
+    """
+    def run(self, edit, loaded=None):
+        """
+        loaded
+            Internal: the relative path of a subdirectory whose listing has been read.
+        """
+        m = model.get(self.view)
+        if not m:
+            return
+
+        if loaded is not None:
+            path, entries, error = expand_results.pop((self.view.id(), loaded), (None, None, None))
+            if path != m.path or self.view.settings().get('dired_rename_mode'):
+                return
+            if error:
+                sublime.status_message('dired: {}'.format(error))
+                return
+            self._update(edit, m, lambda: m.expand(loaded, entries))
+            return
+
+        if m.virtual or m.usage is not None or not m.indent:
+            sublime.status_message('dired: directories cannot be expanded in this view')
+            return
 
+        rendered = m.rendered()
+        dirs = [ rendered[row] for (first, last) in self._rows(self.view.sel())
+                 for row in range(first, last + 1) if rendered[row].is_dir ]
+
+        expanded = [ entry.name for entry in dirs if entry.name in m.expanded ]
+        if expanded:
+            def _collapse():
+                for name in expanded:
+                    m.collapse(name)
+            self._update(edit, m, _collapse)
+            return
+
+        for entry in dirs:
+            name = entry.name
+            if name in m.children:
+                self._update(edit, m, lambda: m.expand(name))
+            else:
+                self._fetch(m.path, name)
+
+    def _fetch(self, path, name):
+        view = self.view
+
+        def _on_scan(entries, error, stamp):
+            expand_results[(view.id(), name)] = (path, entries, error)
+            view.run_command('dired_expand', { 'loaded': name })
+
+        fetch((view.id(), name), join(path, name), _on_scan, needs_stat(view))
+
+    def _update(self, edit, m, change):
+        """
+        Calls `change()` to expand or collapse directories in the model, then patches the view
+        to match.
+        """
+        before = list(zip([ entry.text for entry in m.entries ], m.lines()))
+        change()
+        after = list(zip([ entry.text for entry in m.entries ], m.lines()))
+
+        # The entries above and below the change stay the same, so replace what's between.
+        start = 0
+        while start < min(len(before), len(after)) and before[start] == after[start]:
+            start += 1
+        end = 0
+        while end < min(len(before), len(after)) - start and before[-1 - end] == after[-1 - end]:
+            end += 1
+
+        hunks = [ (start, len(before) - end, after[start:len(after) - end]) ]
+        self.view.set_read_only(False)
+        patch_listing(self.view, edit, hunks)
         self.view.set_read_only(True)
 
-        # Place the cursor.
-        if f:
-            pt = self.fileregion().a
-            if goto:
-                if isdir(join(path, goto)) and not goto.endswith(os.sep):
-                    goto += os.sep
-                try:
-                    line = f.index(goto) + 2
-                    pt = self.view.text_point(line, 0)
-                except ValueError:
-                    pass
+        if m.long:
+            resolve_columns(self.view, m)
+
+
+class DiredScanEventListener(EventListener):
+    def on_close(self, view):
+        # Abandon the reads of a closed view, including its subdirectories', and drop any
+        # results it never rendered.
+        cancel_fetch(view.id())
+        scan_results.pop(view.id(), None)
+        for key in [ key for key in expand_results if key[0] == view.id() ]:
+            del expand_results[key]
+
+
+searches = {}
+# Map from the id of a find results view to the Search filling it.
+
+
+def find_header(view, m):
+    search = searches.get(view.id())
+    text = ' {} matches for {}'.format(len(m.entries), view.settings().get('dired_find'))
+    if search:
+        text += ', searching…'
+    return text
+
+
+class DiredFindCommand(TextCommand, DiredBaseCommand):
+    """
+    Finds the files below the view's directory that match a query (see query.py), like
+    find-dired, and lists them by their relative paths in a new view.  Marks and the file
+    commands work on the results.
+
+    Run in a results view, the search is run again.
+    """
+    def run(self, edit, query=None):
+        if query is None:
+            self.view.window().show_input_panel('Find:', '', self._on_query, None, None)
+            return
+        if not self.view.settings().get('dired_find'):
+            self._on_query(query)
+            return
+
+        try:
+            test = compile_query(query)
+        except QueryError as e:
+            sublime.error_message(str(e))
+            return
+
+        view = self.view
+        path = self.path
+        view.settings().set('dired_find', query)
+        view.set_name('find: {}'.format(query))
+
+        old = model.get(view)
+        search = searches.pop(view.id(), None)
+        if search:
+            search.job.cancel()
+            old = search.previous
+
+        m = model.Model(path, [])
+        m.indent = False
+        m.sorted = False
+        m.long = long_format(view)
+        model.put(view, m)
 
-            self.view.sel().clear()
-            self.view.sel().add(Region(pt, pt))
+        settings = sublime.load_settings('dired.sublime-settings')
+        workers = settings.get('find_workers', 8)
+        limit   = settings.get('find_max_results', 10000)
+
+        job = jobs.Job('Find {}'.format(query), [], lambda job: search.run())
+        search = Search(job, workers, path, test, limit, m.long, old)
+        searches[view.id()] = search
+        jobs.readers.submit(job)
+
+        view.set_read_only(False)
+        render_listing(view, edit, m)
+        view.set_read_only(True)
+
+        def _poll():
+            if searches.get(view.id()) is search:
+                view.run_command('dired_find_update')
+                sublime.set_timeout(_poll, FIND_INTERVAL)
+        sublime.set_timeout(_poll, FIND_INTERVAL)
+
+    def _on_query(self, query):
+        if not query.strip():
+            return
+        window = self.view.window()
+        view = window.new_file()
+        view.set_scratch(True)
+        view.set_name('find: {}'.format(query))
+        view.set_syntax_file('Packages/dired/dired.tmLanguage')
+        view.settings().set('dired_path', self.path)
+        view.settings().set('dired_find', query)
+        view.settings().set('dired_rename_mode', False)
+        view.settings().set('dired_count', 0)
+        registry.register(view, self.path)
+        if self.view.settings().has('dired_long'):
+            view.settings().set('dired_long', self.view.settings().get('dired_long'))
+        window.focus_view(view)
+        view.run_command('dired_find', { 'query': query })
+
+
+class DiredFindUpdateCommand(TextCommand, DiredBaseCommand):
+    """
+    An internal command that adds the matches found since the last update to a find results
+    view, and sorts them when the search is over.
+    """
+    def run(self, edit):
+        view = self.view
+        search = searches.get(view.id())
+        m = model.get(view)
+        if not search or not m or view.settings().get('dired_rename_mode'):
+            return
+        if not view.settings().get('dired_find'):
+            # The view has been reused to show a directory.
+            del searches[view.id()]
+            search.job.cancel()
+            return
+
+        # The job is no longer active once the search has finished, failed, or been cancelled.
+        if search.job in jobs.readers.active():
+            self._append(edit, m, search.results[len(m.entries):])
+            return
 
+        del searches[view.id()]
+
+        done = model.Model(m.path, sort_entries(search.results))
+        done.indent = False
+        done.long = m.long
+        if search.previous:
+            done.inherit_marks(search.previous)
+        done.inherit_marks(m)
+        model.put(view, done)
+
+        rows = self._rows(view.sel())
+        index = rows and done.find(m.rendered()[rows[0][0]].name) or None
+
+        view.set_read_only(False)
+        render_listing(view, edit, done, index)
+        view.set_read_only(True)
+
+        msg = '{} matches'.format(len(done.entries))
+        if search.truncated:
+            msg += ', stopped at find_max_results'
+        sublime.status_message(msg)
+
+    def _append(self, edit, m, entries):
+        view = self.view
+        count = len(m.entries)
+        if entries:
+            m.append(entries)
+            items = list(zip([ entry.text for entry in entries ], m.lines()[count:]))
+
+            view.set_read_only(False)
+            patch_listing(view, edit, [ (count, count, items) ])
+            view.set_read_only(True)
+            if m.long:
+                resolve_columns(view, m)
+
+        header = view.line(view.text_point(1, 0))
+        view.set_read_only(False)
+        view.replace(edit, header, find_header(view, m))
+        view.set_read_only(True)
+
+
+class DiredFindEventListener(EventListener):
+    def on_close(self, view):
+        search = searches.pop(view.id(), None)
+        if search:
+            search.job.cancel()
+
+
+class DiredPageCommand(TextCommand, DiredBaseCommand):
+    """
+    An internal command that renders the next or previous page of a directory too large to
+    render all at once.
+    """
+    def run(self, edit, forward=None):
+        m = model.get(self.view)
+        if not m or not m.virtual or self.view.settings().get('dired_rename_mode'):
+            # Rendering another page would throw away the names being edited.
+            return
+
+        # Center the new page on the entry at the edge we are moving past and keep that entry
+        # at the same place on the screen.
+        index = forward and (m.end - 1) or m.start
+        pt = self.view.text_point(index - m.start + 2, 0)
+        offset = self.view.text_to_layout(pt)[1] - self.view.viewport_position()[1]
+
+        m.start, m.end = m.window(index)
+
+        self.view.set_read_only(False)
+        render_listing(self.view, edit, m, index)
+        self.view.set_read_only(True)
+
+        pt = self.view.text_point(index - m.start + 2, 0)
+        self.view.set_viewport_position((0, self.view.text_to_layout(pt)[1] - offset), False)
 
 
 class DiredNextLineCommand(TextCommand, DiredBaseCommand):
     def run(self, edit, forward=None):
+        # If the cursor is on the first or last rendered entry of a large directory, load the
+        # next page first.
+        m = model.get(self.view)
+        if m and m.virtual and self.filecount():
+            row = self.view.rowcol(self.view.sel()[0].a)[0] - 2
+            if (forward and row == self.filecount() - 1 and m.end < len(m.entries)) or \
+               (not forward and row == 0 and m.start > 0):
+                self.view.run_command('dired_page', { 'forward': forward })
         self.move(forward)
 
 
+scrolling = set()
+# The ids of views being watched for scrolling past the end of their page.
+
+
+def watch_scrolling(view_id):
+    """
+    Renders the next or previous page of a large directory when the user scrolls to the edge
+    of the current one.  Repeats until the view is no longer active.
+    """
+    view = sublime.View(view_id)
+    m = model.models.get(view_id)
+    window = view.window()
+    if not m or not m.virtual or not window or window.active_view() != view:
+        scrolling.discard(view_id)
+        return
+
+    if view.settings().get('dired_rename_mode'):
+        # Keep checking, as paging resumes when rename mode ends.
+        sublime.set_timeout(lambda: watch_scrolling(view_id), 250)
+        return
+
+    count = view.settings().get('dired_count', 0)
+    visible = view.visible_region()
+    if m.end < len(m.entries) and visible.end() >= view.text_point(count + 1, 0):
+        view.run_command('dired_page', { 'forward': True })
+    elif m.start > 0 and visible.begin() <= view.text_point(2, 0):
+        view.run_command('dired_page', { 'forward': False })
+
+    sublime.set_timeout(lambda: watch_scrolling(view_id), 250)
+
+
+def start_watch_scrolling(view):
+    m = model.get(view)
+    if m and m.virtual and view.id() not in scrolling:
+        scrolling.add(view.id())
+        sublime.set_timeout(lambda: watch_scrolling(view.id()), 250)
+
+
+class DiredPageEventListener(EventListener):
+    def on_activated(self, view):
+        start_watch_scrolling(view)
+
+
 class DiredSelect(TextCommand, DiredBaseCommand):
     def run(self, edit, new_view=False):
         path = self.path
@@ -155,13 +864,13 @@ class DiredSelect(TextCommand, DiredBaseCommand):
         if not new_view and reuse_view():
             if len(filenames) == 1 and isdir(join(path, filenames[0])):
                 fqn = join(path, filenames[0])
-                show(self.view.window(), fqn, view_id=self.view.id())
+                show(self.view.window(), fqn, view_id=self.view.id(), inherit=self.view)
                 return
 
         for filename in filenames:
             fqn = join(path, filename)
             if isdir(fqn):
-                show(self.view.window(), fqn, ignore_existing=new_view)
+                show(self.view.window(), fqn, ignore_existing=new_view, inherit=self.view)
             else:
                 self.view.window().open_file(fqn)
 
@@ -211,9 +920,7 @@ class DiredMarkExtensionCommand(TextCommand, DiredBaseCommand):
         else:
             # We have already asked for the extension but had to re-run the command to get an
             # edit object.  (Sublime's command design really sucks.)
-            def _markfunc(oldmark, filename):
-                return filename.endswith(ext) and True or oldmark
-            self._mark(mark=_markfunc, regions=self.fileregion())
+            self._mark_entries(lambda entry: entry.text.endswith(ext))
 
     def on_done(self, ext):
         ext = ext.strip()
@@ -223,6 +930,42 @@ class DiredMarkExtensionCommand(TextCommand, DiredBaseCommand):
             ext = '.' + ext
         self.view.run_command('dired_mark_extension', { 'ext': ext })
 
+class DiredMarkQueryCommand(TextCommand, DiredBaseCommand):
+    """
+    Marks (or with mark=False unmarks) every file matching a query like '*.log size>1G age>30d'.
+    See query.py for the syntax.
+    """
+    def run(self, edit, query=None, mark=True):
+        if query is None:
+            def on_done(query):
+                if query.strip():
+                    self.view.run_command('dired_mark_query', { 'query': query, 'mark': mark })
+            caption = mark and 'Mark:' or 'Unmark:'
+            self.view.window().show_input_panel(caption, '', on_done, None, None)
+            return
+
+        m = model.get(self.view)
+        if not m:
+            return
+
+        try:
+            test = compile_query(query)
+        except QueryError as e:
+            sublime.error_message(str(e))
+            return
+
+        if test.needs_stat and m.unstated():
+            # Read the sizes and times in the background, then try again.
+            view = self.view
+            sublime.status_message('Reading file sizes and times')
+            stat_async(m.path, m.unstated(),
+                       lambda: view.run_command('dired_mark_query', { 'query': query, 'mark': mark }))
+            return
+
+        count = self._mark_entries(test, mark)
+        sublime.status_message('{} {} files'.format(mark and 'Marked' or 'Unmarked', count))
+
+
 class DiredMarkCommand(TextCommand, DiredBaseCommand):
     """
     Marks or unmarks files.
@@ -245,7 +988,7 @@ class DiredMarkCommand(TextCommand, DiredBaseCommand):
 
         # If markall is set, mark/unmark all files.  Otherwise only those that are selected.
         if markall:
-            regions = [ filergn ]
+            regions = None
         else:
             regions = self.view.sel()
 
@@ -273,13 +1016,9 @@ class DiredDeleteCommand(TextCommand, DiredBaseCommand):
             else:
                 msg = "Delete {} items?".format(len(files))
             if sublime.ok_cancel_dialog(msg):
-                for filename in files:
-                    fqn = join(self.path, filename)
-                    if isdir(fqn):
-                        shutil.rmtree(fqn)
-                    else:
-                        os.remove(fqn)
-                self.view.run_command('dired_refresh')
+                paths = [ join(self.path, filename) for filename in files ]
+                workers = sublime.load_settings('dired.sublime-settings').get('delete_workers', 8)
+                jobs.submit(msg.rstrip('?'), [ self.path ], lambda job: fileops.delete(job, paths, workers))
 
 
 class DiredMoveCommand(TextCommand, DiredBaseCommand):
@@ -304,20 +1043,55 @@ class DiredMoveCommand(TextCommand, DiredBaseCommand):
         # ignore it.
         files = self.get_marked() or self.get_selected()
         path = normpath(normcase(path))
-        for filename in files:
-            fqn = normpath(normcase(join(self.path, filename)))
-            if fqn != path:
-                shutil.move(fqn, path)
-        self.view.run_command('dired_refresh')
+        paths = [ fqn for fqn in (normpath(normcase(join(self.path, f))) for f in files) if fqn != path ]
+        if paths:
+            title = 'Move {} items'.format(len(paths))
+            workers = sublime.load_settings('dired.sublime-settings').get('copy_workers', 4)
+            jobs.submit(title, [ self.path, path ], lambda job: fileops.move(job, paths, path, workers))
+
+
+class DiredCopyCommand(TextCommand, DiredBaseCommand):
+    def run(self, edit):
+        files = self.get_marked() or self.get_selected()
+        if files:
+            prompt.start('Copy to:', self.view.window(), self.path, self._copy)
+
+    def _copy(self, path):
+        files = self.get_marked() or self.get_selected()
+
+        if not isabs(path):
+            path = join(self.path, path)
+        if not isdir(path):
+            sublime.error_message('Not a valid directory: {}'.format(path))
+            return
+
+        path = normpath(normcase(path))
+        if path == normpath(normcase(self.path)):
+            sublime.error_message('Cannot copy files onto themselves')
+            return
+
+        paths = [ normpath(normcase(join(self.path, f))) for f in files ]
+        title = 'Copy {} items'.format(len(paths))
+        workers = sublime.load_settings('dired.sublime-settings').get('copy_workers', 4)
+        jobs.submit(title, [ path ], lambda job: fileops.copy(job, paths, path, workers))
 
 
 class DiredRenameCommand(TextCommand, DiredBaseCommand):
     def run(self, edit):
         if self.filecount():
             # Store the original filenames so we can compare later.
-            self.view.settings().set('rename', self.get_all())
+            rename.originals[self.view.id()] = self.get_all()
             self.view.settings().set('dired_rename_mode', True)
             self.view.set_read_only(False)
+            m = model.get(self.view)
+            if m and (m.long or m.usage is not None):
+                # Only the names can be edited.  The long format or disk usage comes back when
+                # rename mode ends and the view is refreshed.
+                rows = self._rows(self.view.sel())
+                m.long = False
+                m.usage = None
+                render_listing(self.view, edit, m, rows and (m.start + rows[0][0]) or None)
+
             self.set_help_text(edit, RENAME_HELP)
 
             # Mark the original filename lines so we can make sure they are in the same
@@ -331,24 +1105,21 @@ class DiredRenameCancelCommand(TextCommand, DiredBaseCommand):
     Cancel rename mode.
     """
     def run(self, edit):
-        self.view.settings().erase('rename')
+        rename.originals.pop(self.view.id(), None)
         self.view.settings().set('dired_rename_mode', False)
+        # The lines were edited by hand, so they can't be patched.
+        self.view.settings().erase('dired_shown_path')
         self.view.run_command('dired_refresh')
 
 
-class RenameError(Exception):
-    pass
-
-
 class DiredRenameCommitCommand(TextCommand, DiredBaseCommand):
     def run(self, edit):
-        if not self.view.settings().has('rename'):
+        before = rename.originals.get(self.view.id())
+        if before is None:
             # Shouldn't happen, but we want to cleanup when things go wrong.
             self.view.run_command('dired_refresh')
             return
 
-        before = self.view.settings().get('rename')
-
         # We marked the set of files with a region.  Make sure the region still has the same
         # number of files.
         after = []
@@ -361,34 +1132,87 @@ class DiredRenameCommitCommand(TextCommand, DiredBaseCommand):
             sublime.error_message('You cannot add or remove lines')
             return
 
-        if len(set(after)) != len(after):
+        # Directories are shown with a trailing separator.  The renames need the bare names so
+        # a directory's old name matches the new name of whatever is taking its place.  Lines in
+        # expanded subdirectories only show the last part of the name.
+        names = []
+        for b, a in zip(before, after):
+            b = b.rstrip(os.sep)
+            a = a.rstrip(os.sep)
+            if os.sep in b and os.sep not in a:
+                a = join(dirname(b), a)
+            names.append((b, a))
+
+        if len(set(a for (b, a) in names)) != len(names):
             sublime.error_message('There are duplicate filenames')
             return
 
-        diffs = [ (b, a) for (b, a) in zip(before, after) if b != a ]
-        if diffs:
-            existing = set(before)
-            while diffs:
-                b, a = diffs.pop(0)
-
-                if a in existing:
-                    # There is already a file with this name.  Give it a temporary name (in
-                    # case of cycles like "x->z and z->x") and put it back on the list.
-                    tmp = tempfile.NamedTemporaryFile(delete=False, dir=self.path).name
-                    os.unlink(tmp)
-                    diffs.append((tmp, a))
-                    a = tmp
-
-                print('dired rename: {} --> {}'.format(b, a))
-                os.rename(join(self.path, b), join(self.path, a))
-                existing.remove(b)
-                existing.add(a)
+        diffs = [ (b, a) for (b, a) in names if b != a ]
+        try:
+            rename.apply(self.path, diffs)
+        except rename.RenameError as e:
+            # Stay in rename mode so the edits can be fixed and committed again.
+            sublime.error_message(str(e))
+            return
 
         self.view.erase_regions('rename')
-        self.view.settings().erase('rename')
+        rename.originals.pop(self.view.id(), None)
         self.view.settings().set('dired_rename_mode', False)
+        self.view.settings().erase('dired_shown_path')
+        self.view.run_command('dired_refresh')
+
+
+class DiredRenamePatternCommand(TextCommand, DiredBaseCommand):
+    """
+    Renames the marked files, or all files if none are marked, by applying a regular
+    expression.  See rename.substitute for the replacement syntax.
+
+    The new names are computed from the listing, not the view, so this works on directories
+    too large to render.
+    """
+    def run(self, edit, pattern=None, replacement=None, start=1):
+        if pattern is None:
+            self.view.window().show_input_panel('Rename pattern:', '', self.on_pattern, None, None)
+            return
+        if replacement is None:
+            def on_replacement(replacement):
+                self.view.run_command('dired_rename_pattern',
+                                      { 'pattern': pattern, 'replacement': replacement, 'start': start })
+            self.view.window().show_input_panel('Replace with:', '', on_replacement, None, None)
+            return
+
+        m = model.get(self.view)
+        if not m:
+            return
+
+        names   = [ entry.name for entry in m.entries ]
+        targets = [ names[i] for i in sorted(m.marked) ] or names
+
+        try:
+            renames = rename.substitute(targets, pattern, replacement, start)
+            rename.check(names, renames)
+        except rename.RenameError as e:
+            sublime.error_message(str(e))
+            return
+
+        if not renames:
+            sublime.status_message('No files to rename')
+            return
+
+        msg = 'Rename {} items?\n\n{}'.format(len(renames), rename.preview(renames))
+        if not sublime.ok_cancel_dialog(msg):
+            return
+
+        try:
+            rename.apply(self.path, renames)
+        except rename.RenameError as e:
+            sublime.error_message(str(e))
         self.view.run_command('dired_refresh')
 
+    def on_pattern(self, pattern):
+        if pattern:
+            self.view.run_command('dired_rename_pattern', { 'pattern': pattern })
+
 
 class DiredUpCommand(TextCommand, DiredBaseCommand):
     def run(self, edit):
@@ -397,7 +1221,132 @@ class DiredUpCommand(TextCommand, DiredBaseCommand):
             return
 
         view_id = (self.view.id() if reuse_view() else None)
-        show(self.view.window(), parent, view_id, goto=basename(self.path.rstrip(os.sep)))
+        show(self.view.window(), parent, view_id, goto=basename(self.path.rstrip(os.sep)),
+             inherit=self.view)
+
+
+SORT_CHOICES = [
+    ('Name', { 'mode': 'name' }),
+    ('Natural name (file2 before file10)', { 'mode': 'natural' }),
+    ('Extension', { 'mode': 'extension' }),
+    ('Size, largest first', { 'mode': 'size' }),
+    ('Time, newest first', { 'mode': 'mtime' }),
+    ('Reverse order', { 'reverse': True }),
+    ('Directories first', { 'dirs_first': True })
+]
+# The quick panel items for dired_sort and the arguments each runs it with.  The last two
+# toggle.
+
+
+class DiredSortCommand(TextCommand, DiredBaseCommand):
+    """
+    Changes the order of the view's listing (see order.py).  Only the listing in memory is
+    re-sorted; the directory isn't read again.
+
+    Without arguments, prompts for the order.
+    """
+    def run(self, edit, mode=None, reverse=None, dirs_first=None):
+        view = self.view
+        m = model.get(view)
+        if not m:
+            return
+        if m.usage is not None or view.settings().get('dired_find'):
+            sublime.status_message('dired: this view cannot be sorted')
+            return
+
+        if mode is None and reverse is None and dirs_first is None:
+            current, rev, first = sort_order(view)
+            items = []
+            for caption, args in SORT_CHOICES:
+                on = (args.get('mode') == current or (args.get('reverse') and rev) or
+                      (args.get('dirs_first') and first))
+                items.append((on and '* ' or '  ') + caption)
+
+            def _on_done(index):
+                if index == -1:
+                    return
+                args = dict(SORT_CHOICES[index][1])
+                if 'reverse' in args:
+                    args['reverse'] = not rev
+                if 'dirs_first' in args:
+                    args['dirs_first'] = not first
+                view.run_command('dired_sort', args)
+
+            view.window().show_quick_panel(items, _on_done)
+            return
+
+        if mode is not None:
+            view.settings().set('dired_sort', mode)
+        if reverse is not None:
+            view.settings().set('dired_sort_reverse', reverse)
+        if dirs_first is not None:
+            view.settings().set('dired_dirs_first', dirs_first)
+
+        if sort_order(view)[0] in order.NEEDS_STAT and m.unstated():
+            # Read the sizes and times in the background, then sort.
+            sublime.status_message('Reading file sizes and times')
+            mode = sort_order(view)[0]
+            stat_async(m.path, m.unstated(), lambda: view.run_command('dired_sort', { 'mode': mode }))
+            return
+
+        rows = self._rows(view.sel())
+        current = rows and m.rendered()[rows[0][0]].name
+
+        m.sort(*sort_order(view))
+        index = current and m.find(current) or None
+        if m.virtual:
+            m.start, m.end = m.window(index or 0)
+
+        view.set_read_only(False)
+        render_listing(view, edit, m, index)
+        view.set_read_only(True)
+
+
+class DiredHistoryCommand(TextCommand, DiredBaseCommand):
+    """
+    Goes back, or forward, to a directory the view showed before, restoring its listing,
+    marks, selection, and scroll position without reading the directory (see history.py).
+    """
+    def run(self, edit, forward=False):
+        view = self.view
+        if view.settings().get('dired_rename_mode'):
+            return
+
+        snap = history.step(view, forward)
+        if not snap:
+            sublime.status_message('No {} history'.format(forward and 'forward' or 'back'))
+            return
+
+        path = snap.path
+        m = snap.model
+        settings = view.settings()
+        settings.set('dired_path', path)
+        settings.set('dired_shown_path', path)
+        settings.erase('dired_find')
+        for key in history.MODES:
+            if key in snap.modes:
+                settings.set(key, snap.modes[key])
+            else:
+                settings.erase(key)
+        view.set_name(basename(path.rstrip(os.sep)))
+        registry.register(view, path)
+        watcher.watch(view.id(), path)
+        model.put(view, m)
+
+        view.set_read_only(False)
+        render_listing(view, edit, m)
+        view.set_read_only(True)
+
+        size = view.size()
+        view.sel().clear()
+        for a, b in snap.sel:
+            view.sel().add(Region(min(a, size), min(b, size)))
+        view.set_viewport_position(snap.viewport, False)
+        start_watch_scrolling(view)
+
+        # Disk usage totals may have been counted since, so they are always refreshed.
+        if snap.stale() or m.usage is not None:
+            view.run_command('dired_refresh')
 
 
 class DiredGotoCommand(TextCommand, DiredBaseCommand):
@@ -411,10 +1360,6 @@ class DiredGotoCommand(TextCommand, DiredBaseCommand):
         show(self.view.window(), path, view_id=self.view.id())
 
 
-from sublime_plugin import EventListener
-from .common import first
-
-
 def groups_on_preview(window) :
     """
     Retrun group number of dired(active) and preview.
@@ -439,7 +1384,7 @@ class DiredPreviewCommand(TextCommand, DiredBaseCommand):
     def run(self, edit):        
         window = self.view.window()
         preview_id = self.view.settings().get('preview_id')
-        preview_view = first(window.views(), lambda v: v.id() == preview_id)
+        preview_view = registry.get(window, preview_id)
 
         # Preview mode on.
         if not 'Preview: ' in self.view.name()[0:9] :
@@ -480,7 +1425,7 @@ class DiredPreviewCloseCommand(TextCommand, DiredBaseCommand):
 
         # Get directory preview view.
         preview_id = self.view.settings().get('preview_id')
-        preview_view = first(window.views(), lambda v: v.id() == preview_id)
+        preview_view = registry.get(window, preview_id)
         window.focus_group(groups[1])
 
         # For image file preview.
@@ -503,17 +1448,44 @@ class DiredPreviewCloseCommand(TextCommand, DiredBaseCommand):
             window.focus_group(groups[0])
 
 
-class DiredPreviewEventListener(EventListener, DiredBaseCommand):
-    def on_selection_modified(self, view):
-        self.view = view
-        if 'text.dired' in self.view.scope_name(self.view.sel()[0].a) :
-            if self.view.settings().get('preview_key') :
-                path_list = get_path_list(self.path, self.get_selected(), False)
+class DiredPreviewEventListener(ViewEventListener, DiredBaseCommand):
+    """
+    Previews the entry under the cursor once it stops moving (see preview.py).  Only attached
+    to dired views.
+    """
+    @classmethod
+    def is_applicable(cls, settings):
+        return settings.get('dired_path') is not None
 
-                if path_list :
-                    self.view.settings().set('preview_key', False)
-                    self.view.window().run_command('dired_preview_refresh', {'path':path_list[0]})
-                    self.view.settings().set('preview_key', True)
+    def on_selection_modified(self):
+        if self.view.settings().get('preview_key'):
+            delay = sublime.load_settings('dired.sublime-settings').get('preview_delay', 150)
+            preview.request(self.view.id(), self._preview, delay)
+
+    def on_close(self):
+        preview.cancel(self.view.id())
+
+    def _preview(self):
+        view = self.view
+        if not view.settings().get('preview_key') or not view.window():
+            return
+
+        path_list = get_path_list(self.path, self.get_selected(), False)
+        if not path_list:
+            return
+
+        view.settings().set('preview_key', False)
+        view.window().run_command('dired_preview_refresh', {'path':path_list[0]})
+        view.settings().set('preview_key', True)
+
+        # Read ahead the entries on either side of the cursor.
+        m = model.get(view)
+        rows = len(view.sel()) and self._rows([ view.sel()[0] ])
+        if m and rows:
+            entries = m.rendered()
+            row = rows[0][0]
+            neighbors = [ entries[i] for i in (row - 1, row + 1) if 0 <= i < len(entries) ]
+            preview.prefetch([ join(self.path, entry.name) for entry in neighbors ])
 
 
 class DiredPreviewRefreshCommand(TextCommand, DiredBaseCommand):
@@ -524,21 +1496,26 @@ class DiredPreviewRefreshCommand(TextCommand, DiredBaseCommand):
 
         # Get directory preview view.
         preview_id = self.view.settings().get('preview_id')
-        preview_view = first(window.views(), lambda v: v.id() == preview_id)
+        preview_view = registry.get(window, preview_id)
 
 
         if os.path.isfile(path):
-            if preview_view :
+            # Files are shown in a scratch view instead of being opened so huge files aren't
+            # loaded.  Enter in the preview opens the file.
+            if preview_view and preview_view.settings().get('dired_path'):
                 window.focus_view(preview_view)
                 window.run_command('close_file')
-            window.open_file(path, sublime.TRANSIENT)
-            try :
-                window.active_view().set_read_only(True)
-                window.active_view().set_scratch(True)
-            except :
-                pass
+                preview_view = None
+            if not preview_view:
+                preview_view = window.new_file()
+                preview_view.set_scratch(True)
+                preview_view.settings().set('dired_file_preview', True)
+                self.view.settings().set('preview_id', preview_view.id())
+            preview_view.run_command('dired_preview_file', {'path':path})
 
         elif os.path.isdir(path):
+            if preview_view :
+                preview_view.settings().erase('dired_file_preview')
             if not preview_view :
                 show(window, path)
             else :
@@ -549,6 +1526,39 @@ class DiredPreviewRefreshCommand(TextCommand, DiredBaseCommand):
         window.focus_group(groups[0])
 
 
+class DiredPreviewFileCommand(TextCommand):
+    """
+    An internal command that fills a file preview view with the start of the file `path`, or
+    a hex dump if it is binary.  See preview.py.
+    """
+    def run(self, edit, path):
+        settings = sublime.load_settings('dired.sublime-settings')
+        try:
+            text = preview.file_text(path, settings.get('preview_head_kb', 64) * 1024,
+                                     settings.get('preview_tail_kb', 0) * 1024)
+        except OSError as e:
+            text = '{}\n\nUnable to read: {}'.format(path, e.strerror)
+
+        self.view.set_read_only(False)
+        self.view.replace(edit, Region(0, self.view.size()), text)
+        self.view.set_read_only(True)
+        self.view.sel().clear()
+        self.view.sel().add(Region(0, 0))
+        self.view.show(0)
+        self.view.set_name('Preview: ' + basename(path))
+        self.view.settings().set('dired_preview_path', path)
+
+
+class DiredPreviewOpenCommand(TextCommand):
+    """
+    Opens the file shown in a file preview view.
+    """
+    def run(self, edit):
+        path = self.view.settings().get('dired_preview_path')
+        if path:
+            self.view.window().open_file(path)
+
+
 def bookmarks():
     return sublime.load_settings('dired.sublime-settings').get('bookmarks', [])
 
@@ -616,7 +1626,7 @@ class DiredAddProjectCommand(TextCommand, DiredBaseCommand):
                     pr_data = {'folders' : [{'follow_symlinks': True, 'path':path}]}
                 self.view.window().set_project_data(pr_data)
                 sublime.status_message('Add to this project.')
-                self.view.erase_regions('marked')
+                self.clear_marks()
 
 
 class DiredRemoveFromProjectCommand(TextCommand, DiredBaseCommand):
@@ -649,7 +1659,7 @@ class DiredAddBookmarkCommand(TextCommand, DiredBaseCommand):
             sublime.save_settings('dired.sublime-settings')
 
             sublime.status_message('Bookmarking succeeded.')
-            self.view.erase_regions('marked')
+            self.clear_marks()
 
 
 class DiredRemoveBookmarkCommand(TextCommand, DiredBaseCommand):
@@ -729,43 +1739,75 @@ class DiredGotoAnywhereCommand(TextCommand, DiredCommand):
 
 class DiredJumptoNameCommand(TextCommand, DiredBaseCommand):
     """
-    Fuzzy-Search file/directory name in current directory.
-    """
-    def run(self, view):
-        path = self.path
-        window = self.view.window()
-        names = os.listdir(path)
-        f = []
-        for name in names:
-            if isdir(join(path, name)):
-                name += os.sep
-            f.append(name)
-
-        def on_done(select):
-            if not select == -1 :
-                line_str = f[select]
-                r_list = self.view.find_all(line_str, sublime.LITERAL)
-
-                # Make match whole word.
-                if len(r_list) > 1 :
-                    for r in r_list :
-                        find_str = self.view.substr(self.view.line(r))
-                        if find_str == line_str :
-                            break
-                else :
-                    r = r_list[0]
+    Jumps to a file or directory by name.  The names are matched fuzzily as the name is typed
+    (see fuzzy.py) and the cursor follows the best match.  Enter stays there and Escape goes
+    back.
 
-                if self.p_key :
-                    window.run_command('dired_preview_refresh', {'path':path + line_str})
-
-
-                self.view.sel().clear()
-                self.view.sel().add(r.a)
-                self.view.show(r.a)
-
-                if self.p_key :
-                    self.view.settings().set('preview_key', True)
+    The names come from the view's model, so nothing is read from disk or searched for in the
+    buffer.
+    """
+    def run(self, edit, index=None):
+        """
+        index
+            Used internally to move the cursor to entry `index` of the model.
+        """
+        m = model.get(self.view)
+        if not m:
+            return
+        if index is not None:
+            self._goto(edit, m, index)
+            return
 
+        self.origin = list(self.view.sel())
+        self.viewport = self.view.viewport_position()
         self.p_key = self.view.settings().get('preview_key')
         self.view.settings().set('preview_key', False)
-        window.show_quick_panel(f, on_done)
+        self.view.window().show_input_panel('Jump to:', '', self.on_done, self.on_change,
+                                            self.on_cancel)
+
+    def on_change(self, text):
+        m = model.get(self.view)
+        if not m or not text:
+            return
+        matches = m.matcher().match(text, limit=JUMP_CHOICES)
+        if not matches:
+            sublime.status_message('No match for {}'.format(text))
+            return
+        self.view.run_command('dired_jumpto_name', { 'index': matches[0] })
+        sublime.status_message(' | '.join(m.entries[i].text for i in matches))
+
+    def on_done(self, text):
+        self.on_change(text)
+        if self.p_key:
+            self.view.settings().set('preview_key', True)
+            path_list = get_path_list(self.path, self.get_selected(), False)
+            if path_list:
+                self.view.window().run_command('dired_preview_refresh', {'path': path_list[0]})
+
+    def on_cancel(self):
+        self.view.sel().clear()
+        self.view.sel().add_all(self.origin)
+        self.view.set_viewport_position(self.viewport, False)
+        if self.p_key:
+            self.view.settings().set('preview_key', True)
+
+    def _goto(self, edit, m, index):
+        if not (m.start <= index < m.end):
+            # Render the page with the entry on it.
+            m.start, m.end = m.window(index)
+            self.view.set_read_only(False)
+            render_listing(self.view, edit, m, index)
+            self.view.set_read_only(True)
+            return
+        pt = self.view.text_point(index - m.start + 2, 0)
+        self.view.sel().clear()
+        self.view.sel().add(Region(pt, pt))
+        self.view.show(pt)
+
+
+def plugin_loaded():
+    # Views restored from the last session have their text but no model, so rebuild them.
+    for window in sublime.windows():
+        for view in window.views():
+            if view.settings().get('dired_path') and not view.settings().get('dired_rename_mode'):
+                view.run_command('dired_refresh')
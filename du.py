@@ -0,0 +1,351 @@
+"""
+Disk usage (ncdu-style) mode.
+
+In this mode a dired view shows the space used by each entry, largest first.  The directory
+tree is walked by a background job using a pool of threads, and the view is updated with the
+partial totals as they grow.  Files with several hard links are only counted once per walk.
+
+The total of every directory the walk finishes is cached, validated by the directory's
+mtime and inode, so moving down into a subdirectory or back up to its parent is answered
+from the cache instead of walking the tree again.  A walk also takes the totals of the
+subdirectories it reaches from the cache when they are current, so walking a parent after a
+subdirectory only walks the rest.  Note that a change deep inside a subdirectory doesn't
+change the mtime of the directories above it, and that hard links are only counted once
+within the parts of a tree walked together.  The least recently used totals are dropped once
+the cache grows past `du_cache_max_mb`.
+"""
+
+import os, stat, threading
+from collections import OrderedDict
+
+import sublime
+
+from .cache import normalize, stamp, ENTRY_BYTES
+from .columns import size as format_size
+from .fileops import Engine
+from .render import sort_key
+from . import jobs
+
+UPDATE_INTERVAL = 500
+# Milliseconds between updates of views showing a walk in progress.
+
+BAR_WIDTH = 10
+# The width of the bar comparing each entry to the largest.
+
+running = {}
+# Map from normalized directory path to the Walk queued or in progress for it.
+
+polling = set()
+# The (normalized path, view id) of each view being updated while its directory is walked.
+
+
+class Usage:
+    __slots__ = ('stamp', 'total', 'sizes')
+
+    def __init__(self, stamp, total, sizes):
+        self.stamp = stamp
+
+        self.total = total
+        # The bytes used by everything in the directory, not counting the directory itself.
+
+        self.sizes = sizes
+        # Map from the name of each subdirectory to the bytes used by its tree.
+
+
+class UsageCache:
+    """
+    An LRU cache of directory totals.  It is safe to use from multiple threads.
+    """
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+
+        self.lock  = threading.Lock()
+        self.items = OrderedDict()
+        # Map from normalized path to (Usage, size) ordered from least to most recently used.
+
+        self.bytes = 0
+        # The estimated size of everything in `items`.
+
+    def get(self, path):
+        """
+        Returns the Usage cached for the normalized `path`, current or not, or None.
+        """
+        with self.lock:
+            item = self.items.get(path)
+            if item is None:
+                return None
+            self.items.move_to_end(path)
+            return item[0]
+
+    def put(self, path, usage):
+        # Estimated as the listing cache does, with the Usage and its path counted as an entry.
+        size = ENTRY_BYTES + len(path) + sum(ENTRY_BYTES + len(name) for name in usage.sizes)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            self._remove(path)
+            self.items[path] = (usage, size)
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self.items)))
+
+    def _remove(self, path):
+        item = self.items.pop(path, None)
+        if item:
+            self.bytes -= item[1]
+
+
+results = UsageCache()
+
+
+def disk_size(st):
+    """
+    Returns the space allocated to a file, which can be less than its size for sparse files.
+    """
+    blocks = getattr(st, 'st_blocks', None)
+    return (blocks is None) and st.st_size or blocks * 512
+
+
+class _Node:
+    __slots__ = ('path', 'name', 'parent', 'top', 'stamp', 'pending', 'own', 'total', 'sizes')
+
+    def __init__(self, path, name, parent, top, stamp):
+        self.path   = path
+        self.name   = name
+        self.parent = parent
+
+        self.top = top
+        # The name of the subdirectory of the walk's root this directory is in.
+
+        self.stamp = stamp
+
+        self.pending = 1
+        # Subdirectories that must be finished before this directory's total is known.
+        # Starts at 1 for the task scanning it.
+
+        self.own   = 0
+        self.total = 0
+        self.sizes = {}
+        # The bytes used by the directory itself, by its tree including itself, and by each
+        # of its subdirectories' trees.
+
+
+class Walk(Engine):
+    """
+    Totals the space used by each subdirectory of `path`.
+    """
+    def __init__(self, job, workers, path):
+        Engine.__init__(self, job, workers)
+        self.path = path
+
+        self.seen = set()
+        # The (st_dev, st_ino) of hard linked files already counted.
+
+        self.partial = {}
+        # Map from each subdirectory of `path` to the bytes counted in it so far.
+
+    def run(self):
+        root = _Node(self.path, None, None, None, stamp(self.path))
+        self._submit(self._scan, root)
+        self.wait()
+
+    def _scan(self, node):
+        self.job.check()
+        try:
+            entries = list(os.scandir(node.path))
+        except OSError:
+            # Unreadable directories are counted as empty, like du.
+            entries = []
+
+        subdirs = []
+        for de in entries:
+            try:
+                st = de.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+            top = node.top or de.name
+            if stat.S_ISDIR(st.st_mode):
+                current = (st.st_mtime_ns, st.st_ino)
+                cached  = results.get(normalize(de.path))
+                if cached and cached.stamp == current:
+                    # Counted by an earlier walk and unchanged since.
+                    size = disk_size(st) + cached.total
+                    node.sizes[de.name] = size
+                    node.total += size
+                else:
+                    child = _Node(de.path, de.name, node, top, current)
+                    child.own = child.total = disk_size(st)
+                    subdirs.append(child)
+                    size = child.total
+            else:
+                size = self._count(st)
+                node.total += size
+
+            if node.top or stat.S_ISDIR(st.st_mode):
+                with self.lock:
+                    self.partial[top] = self.partial.get(top, 0) + size
+            self.job.progress(files=1, bytes=size)
+
+        with self.lock:
+            node.pending += len(subdirs)
+        for child in subdirs:
+            self._submit(self._scan, child)
+        self._release(node)
+
+    def _count(self, st):
+        size = disk_size(st)
+        if st.st_nlink > 1:
+            key = (st.st_dev, st.st_ino)
+            with self.lock:
+                if key in self.seen:
+                    return 0
+                self.seen.add(key)
+        return size
+
+    def _release(self, node):
+        while node:
+            with self.lock:
+                node.pending -= 1
+                if node.pending:
+                    return
+                results.put(normalize(node.path), Usage(node.stamp, node.total - node.own,
+                                                        node.sizes))
+                parent = node.parent
+                if parent:
+                    parent.sizes[node.name] = node.total
+                    parent.total += node.total
+            if parent is None:
+                self.finish()
+            node = parent
+
+
+def usage(path):
+    """
+    Returns the cached Usage of the directory `path` if it is still current, otherwise None.
+    """
+    result = results.get(normalize(path))
+    try:
+        if result and result.stamp == stamp(path):
+            return result
+    except OSError:
+        pass
+    return None
+
+
+def sizes(path):
+    """
+    Returns a map from the names of the subdirectories of `path` to their totals, and True if
+    they are final or False if a walk is still counting them.
+    """
+    result = usage(path)
+    if result:
+        return result.sizes, True
+    walk = running.get(normalize(path))
+    if walk:
+        with walk.lock:
+            return dict(walk.partial), False
+    return {}, False
+
+
+def start(path, view_id, callback):
+    """
+    Starts walking `path` in the background unless its totals are cached or it is already
+    being walked.  While the walk runs `callback()` is called every UPDATE_INTERVAL on the
+    main thread, and once more when it is done.  Only one callback is kept per view.
+    """
+    key = normalize(path)
+    if usage(path) or (key, view_id) in polling:
+        return
+
+    if key not in running:
+        workers = sublime.load_settings('dired.sublime-settings').get('du_workers', 8)
+
+        def _work(job):
+            try:
+                walk.run()
+            finally:
+                running.pop(key, None)
+
+        # The job modifies nothing, so there are no directories to lock or refresh.
+        job  = jobs.Job('Disk usage of {}'.format(path), [], _work)
+        walk = running[key] = Walk(job, workers, path)
+        jobs.readers.submit(job)
+
+    walk = running[key]
+    polling.add((key, view_id))
+
+    def _poll():
+        if running.get(key) is walk and walk.job not in jobs.readers.active():
+            # Cancelled before it started.
+            running.pop(key, None)
+        if running.get(key) is not walk:
+            polling.discard((key, view_id))
+        callback()
+        if (key, view_id) in polling:
+            sublime.set_timeout(_poll, UPDATE_INTERVAL)
+
+    sublime.set_timeout(_poll, UPDATE_INTERVAL)
+
+
+def apply(m):
+    """
+    Fills in the sizes of the entries of the model `m` and sorts them largest first, with the
+    directories that haven't been counted yet at the end.  Returns True if the sizes are
+    final.
+
+    The sizes of files come from their lstat data, which must have been read already (see
+    scan.stat_entries).
+    """
+    subdirs, final = sizes(m.path)
+
+    usage = {}
+    for entry in m.entries:
+        if entry.is_dir and not entry.is_link:
+            usage[entry.name] = subdirs.get(entry.name)
+        else:
+            usage[entry.name] = entry.st and disk_size(entry.st) or 0
+
+    m.usage = usage
+    m.sorted = False
+    m.largest = max([ size for size in usage.values() if size ] or [ 0 ])
+    m.entries = sorted(m.entries, key=lambda entry: (usage[entry.name] is None,
+                                                     -(usage[entry.name] or 0),
+                                                     sort_key(entry.name)))
+    return final
+
+
+def line(m, entry, label=None):
+    """
+    Returns the disk usage mode line for `entry`.  `label` is the text shown for its name, by
+    default entry.text.
+    """
+    label = label or entry.text
+    size = m.usage.get(entry.name)
+    if size is None:
+        return '{:>6}  {}  {}'.format('…', ' ' * (BAR_WIDTH + 2), label)
+    bar = m.largest and int(round(BAR_WIDTH * float(size) / m.largest)) or 0
+    return '{:>6}  [{}]  {}'.format(format_size(size), ('#' * bar).ljust(BAR_WIDTH), label)
+
+
+def header(m):
+    """
+    Returns the total for the header line of a view in disk usage mode.
+    """
+    total = sum(size for size in m.usage.values() if size)
+    counting = normalize(m.path) in running
+    return ' {} total{}'.format(format_size(total), counting and ', counting…' or '')
+
+
+def _configure():
+    settings = sublime.load_settings('dired.sublime-settings')
+    results.max_bytes = settings.get('du_cache_max_mb', 16) * 1024 * 1024
+
+
+def plugin_loaded():
+    settings = sublime.load_settings('dired.sublime-settings')
+    settings.clear_on_change('dired.du')
+    settings.add_on_change('dired.du', _configure)
+    _configure()
@@ -0,0 +1,559 @@
+"""
+File operations run as background jobs.  See jobs.py.
+
+Each function takes the Job as its first argument, reports progress through it, and calls
+job.check() regularly so it can be cancelled.
+"""
+
+import os, shutil, threading, errno, stat
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, isdir, islink, exists, basename
+
+from .jobs import JobCancelled
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+UNLINK_BATCH = 256
+# The number of files in a directory unlinked by one task of the parallel delete.
+
+MAX_OPEN_DIRS = 128
+# The number of directories the parallel delete keeps open, or queued to be opened, at once.
+# Below a wide tree the rest are deleted depth-first by the task that found them.
+
+_scandir = getattr(os, 'scandir', None)
+# os.scandir is only available in Python 3.5+.  Older plugin hosts fall back to listdir.
+
+_parallel_delete = (_scandir in getattr(os, 'supports_fd', ()) and
+                    all(f in getattr(os, 'supports_dir_fd', ())
+                        for f in (os.open, os.unlink, os.rmdir)))
+# The parallel delete needs os.scandir(fd) (Python 3.7+) and open, unlink, and rmdir with
+# dir_fd.
+
+
+def count(job, path, with_bytes=False):
+    """
+    Returns (files, bytes) for the tree at `path`.  Directories count as files since they
+    must be removed too.  Bytes are only totaled if `with_bytes` is True since that requires a
+    stat for every file.
+    """
+    if not isdir(path) or islink(path):
+        return (1, with_bytes and os.lstat(path).st_size or 0)
+
+    files = nbytes = 0
+    for root, dirs, names in os.walk(path):
+        job.check()
+        files += len(dirs) + len(names)
+        if with_bytes:
+            for name in names:
+                try:
+                    nbytes += os.lstat(join(root, name)).st_size
+                except OSError:
+                    pass
+    return (files + 1, nbytes)
+
+
+def delete(job, paths, workers=1):
+    """
+    Deletes the files and directory trees in `paths`.
+
+    workers
+        The number of threads used to delete each tree.  If 1, or if the platform can't
+        delete relative to directory file descriptors, trees are deleted serially.
+    """
+    # A directory symlink is listed as "link/", which isdir and islink would both follow.
+    paths = [ path.rstrip(os.sep) for path in paths ]
+
+    parallel = workers > 1 and _parallel_delete
+    if not parallel:
+        for path in paths:
+            job.add_total(files=count(job, path)[0])
+
+    for path in paths:
+        if not isdir(path) or islink(path):
+            if parallel:
+                job.add_total(files=1)
+            os.remove(path)
+            job.progress(files=1)
+        elif parallel:
+            job.add_total(files=1)
+            try:
+                ParallelDelete(job, path, workers).run()
+            except OSError as e:
+                # Whatever went wrong, the serial delete either works around it or reports it.
+                print('dired: parallel delete of {} failed, retrying serially: {}'.format(path, e))
+                if exists(path):
+                    delete_tree(job, path)
+        else:
+            delete_tree(job, path)
+
+
+def delete_tree(job, path):
+    """
+    Deletes the directory tree at `path` one file at a time.
+    """
+    for root, dirs, names in os.walk(path, topdown=False):
+        job.check()
+        for name in names:
+            os.remove(join(root, name))
+        for name in dirs:
+            # os.walk lists symlinks to directories with the directories.
+            fqn = join(root, name)
+            if islink(fqn):
+                os.remove(fqn)
+            else:
+                os.rmdir(fqn)
+        job.progress(files=len(names) + len(dirs))
+    os.rmdir(path)
+    job.progress(files=1)
+
+
+class _Dir:
+    __slots__ = ('name', 'path', 'parent', 'pending', 'fd')
+
+    def __init__(self, name, path, parent):
+        self.name   = name
+        self.path   = path
+        self.parent = parent
+        # The directory is opened and removed by its name relative to the parent's descriptor.
+        # The full path is only used for the root.
+
+        self.pending = 1
+        # Tasks and subdirectories that must finish before this directory can be removed.
+        # Starts at 1 for the task scanning it.
+
+        self.fd = None
+        # The open directory, kept open until everything in it is gone.
+
+
+class Engine:
+    """
+    Runs the tasks of one operation on a pool of threads.  The first error stops the
+    operation and is re-raised by wait().
+    """
+    def __init__(self, job, workers):
+        self.job  = job
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.error = None
+
+    def wait(self):
+        """
+        Waits until a task calls finish() or fails, then re-raises the first error.
+        """
+        while not self.done.wait(0.5):
+            if self.job.cancelled:
+                self._fail(JobCancelled())
+        self.pool.shutdown(wait=True)
+        if self.error:
+            raise self.error
+
+    def finish(self):
+        self.done.set()
+
+    def _submit(self, task, *args):
+        try:
+            self.pool.submit(self._run_task, task, *args)
+        except RuntimeError:
+            # The pool is shut down once the operation has finished or failed, and tasks
+            # still running may try to queue more.
+            if not self.done.is_set():
+                raise
+
+    def _run_task(self, task, *args):
+        try:
+            if self.error is None:
+                task(*args)
+            else:
+                self._skipped(task, args)
+        except Exception as e:
+            # Any error, not only OSError, must stop the operation or wait() never returns.
+            self._fail(e)
+
+    def _skipped(self, task, args):
+        """
+        Called instead of a task that was queued before another task failed.
+        """
+        pass
+
+    def _fail(self, e):
+        with self.lock:
+            if self.error is None:
+                self.error = e
+        self.done.set()
+
+
+class ParallelDelete(Engine):
+    """
+    Deletes a directory tree using a pool of threads.
+
+    Each directory is opened once, relative to its parent's file descriptor, and scanned with
+    os.scandir on its own descriptor.  Its files are unlinked relative to that descriptor in
+    batches spread across the pool, and its subdirectories are opened and scanned by their own
+    tasks.  A directory is removed relative to its parent's descriptor as soon as its last file
+    and subdirectory are gone, so removal proceeds bottom-up.  Nothing below the root is
+    reached by path, so a directory being renamed or replaced by a symlink in the meantime
+    can't redirect the delete.
+    """
+    def __init__(self, job, path, workers):
+        Engine.__init__(self, job, workers)
+        self.root = _Dir(None, path, None)
+
+        self.open = set()
+        # The directories whose descriptors are open.
+
+        self.open_dirs = 1
+        # The directories open or queued to be opened, starting with the root.  Limited to
+        # MAX_OPEN_DIRS so a wide tree can't run out of file descriptors.
+
+    def run(self):
+        """
+        Deletes the tree, re-raising the first error any task hit.
+        """
+        self._submit(self._scan, self.root)
+        try:
+            self.wait()
+        finally:
+            # After a failure, close the directories that weren't finished.  No tasks are
+            # running by now.
+            for node in self.open:
+                os.close(node.fd)
+            self.open.clear()
+
+    def _scan(self, node, inline=False):
+        """
+        Opens and scans the directory `node`.  If `inline`, everything in it is deleted before
+        returning rather than by queued tasks.
+        """
+        self.job.check()
+        flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0) | getattr(os, 'O_NOFOLLOW', 0)
+        if node.parent:
+            fd = os.open(node.name, flags, dir_fd=node.parent.fd)
+        else:
+            fd = os.open(node.path, flags)
+        with self.lock:
+            node.fd = fd
+            self.open.add(node)
+
+        names = []
+        subdirs = []
+        for de in os.scandir(fd):
+            if de.is_dir(follow_symlinks=False):
+                subdirs.append(de.name)
+            else:
+                names.append(de.name)
+
+        self.job.add_total(files=len(names) + len(subdirs))
+
+        batches = [ names[i:i+UNLINK_BATCH] for i in range(0, len(names), UNLINK_BATCH) ]
+        with self.lock:
+            node.pending += len(batches) + len(subdirs)
+
+        for batch in batches:
+            if inline:
+                self._unlink(node, batch)
+            else:
+                self._submit(self._unlink, node, batch)
+        for name in subdirs:
+            child = _Dir(name, join(node.path, name), node)
+            with self.lock:
+                queue = not inline and self.open_dirs < MAX_OPEN_DIRS
+                self.open_dirs += 1
+            if queue:
+                self._submit(self._scan, child)
+            else:
+                self._scan(child, inline=True)
+
+        self._release(node)
+
+    def _unlink(self, node, names):
+        self.job.check()
+        for name in names:
+            os.unlink(name, dir_fd=node.fd)
+        self.job.progress(files=len(names))
+        self._release(node)
+
+    def _release(self, node):
+        """
+        Called when one of the things `node` was waiting on has finished.  Removes it, and
+        then any parents that were only waiting on it, if nothing else is left.
+        """
+        while node:
+            with self.lock:
+                node.pending -= 1
+                if node.pending:
+                    return
+                self.open.discard(node)
+                self.open_dirs -= 1
+            os.close(node.fd)
+            if node.parent:
+                os.rmdir(node.name, dir_fd=node.parent.fd)
+            else:
+                os.rmdir(node.path)
+            self.job.progress(files=1)
+            node = node.parent
+        self.finish()
+
+
+COPY_CHUNK = 8 * 1024 * 1024
+# Bytes copied between progress updates and cancellation checks.
+
+_NOT_SUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF,
+                  errno.ETXTBSY)
+# Errors meaning a fast copy path can't be used for this pair of files.
+
+FICLONE = 0x40049409
+# Linux ioctl that makes the destination share the source's blocks (btrfs, xfs, ...).
+
+
+def reflink(fsrc, fdst):
+    """
+    Tries to clone the file `fsrc` into `fdst` without copying any data.  Returns True if it
+    worked.
+    """
+    if fcntl is None or not hasattr(fcntl, 'ioctl'):
+        return False
+    try:
+        fcntl.ioctl(fdst, FICLONE, fsrc)
+        return True
+    except (OSError, IOError) as e:
+        if e.errno in _NOT_SUPPORTED or e.errno in (errno.ENOTTY, errno.EPERM):
+            return False
+        raise
+
+
+def copy_data(job, fsrc, fdst, size):
+    """
+    Copies `size` bytes from the file descriptor `fsrc` to `fdst`.
+
+    The file is cloned if the filesystem supports reflinks.  Otherwise the data is copied
+    inside the kernel with copy_file_range or sendfile if the platform supports it, falling
+    back to a read/write loop.
+    """
+    job.check()
+    if size and reflink(fsrc, fdst):
+        job.progress(bytes=size)
+        return
+
+    copied = 0
+
+    for fast in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+        if fast is None:
+            continue
+        try:
+            while copied < size:
+                job.check()
+                count = min(size - copied, COPY_CHUNK)
+                if fast is os.sendfile:
+                    n = fast(fdst, fsrc, copied, count)
+                else:
+                    n = fast(fsrc, fdst, count)
+                if n == 0:
+                    break
+                copied += n
+                job.progress(bytes=n)
+            return
+        except OSError as e:
+            if copied or e.errno not in _NOT_SUPPORTED:
+                raise
+
+    while True:
+        job.check()
+        data = os.read(fsrc, COPY_CHUNK)
+        if not data:
+            break
+        os.write(fdst, data)
+        job.progress(bytes=len(data))
+
+
+def copy_file(job, src, dst, remove_source=False):
+    """
+    Copies the regular file `src` to `dst` along with its permissions and times.
+
+    If `remove_source` is True, `src` is deleted once the copy is verified to be complete.
+    """
+    fsrc = os.open(src, os.O_RDONLY)
+    try:
+        st = os.fstat(fsrc)
+        fdst = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, stat.S_IMODE(st.st_mode))
+        try:
+            copy_data(job, fsrc, fdst, st.st_size)
+            copied = os.fstat(fdst).st_size
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+
+    if copied != st.st_size:
+        raise OSError(errno.EIO, 'Copied {} of {} bytes'.format(copied, st.st_size), src)
+
+    shutil.copystat(src, dst)
+    if remove_source:
+        os.unlink(src)
+    job.progress(files=1)
+
+
+class _CopyDir:
+    __slots__ = ('src', 'dst', 'parent', 'pending')
+
+    def __init__(self, src, dst, parent):
+        self.src = src
+        self.dst = dst
+        self.parent = parent
+
+        self.pending = 1
+        # Entries that must be copied before the directory is finished.  Starts at 1 for the
+        # task scanning it.
+
+
+class ParallelCopy(Engine):
+    """
+    Copies files and directory trees using a pool of threads, optionally removing the
+    sources (a move between filesystems).
+
+    Directories are created as they are scanned and every file is copied by its own task.
+    A directory's times and permissions are copied (and with remove_source the source
+    directory removed) once everything in it is done.
+    """
+    def __init__(self, job, workers, remove_source=False):
+        Engine.__init__(self, job, workers)
+        self.remove_source = remove_source
+        self.root = _CopyDir(None, None, None)
+
+    def run(self, pairs):
+        """
+        Copies each (src, dst) in `pairs`, re-raising the first error any task hit.
+        """
+        for src, dst in pairs:
+            if os.path.lexists(dst):
+                raise OSError(errno.EEXIST, 'Destination path already exists', dst)
+
+        with self.lock:
+            self.root.pending += len(pairs)
+        try:
+            for src, dst in pairs:
+                self._entry(self.root, src, dst, os.lstat(src))
+            self._release(self.root)
+        except OSError as e:
+            self._fail(e)
+        self.wait()
+
+    def _entry(self, parent, src, dst, st):
+        if stat.S_ISDIR(st.st_mode):
+            self.job.add_total(files=1)
+            self._submit(self._copy_dir, _CopyDir(src, dst, parent))
+        elif stat.S_ISLNK(st.st_mode):
+            self.job.add_total(files=1)
+            os.symlink(os.readlink(src), dst)
+            if self.remove_source:
+                os.unlink(src)
+            self.job.progress(files=1)
+            self._release(parent)
+        elif stat.S_ISREG(st.st_mode):
+            self.job.add_total(files=1, bytes=st.st_size)
+            self._submit(self._copy_file, parent, src, dst)
+        elif stat.S_ISFIFO(st.st_mode):
+            # Opening a FIFO would block until something writes to it, so make a new one.
+            self.job.add_total(files=1)
+            os.mkfifo(dst, stat.S_IMODE(st.st_mode))
+            if self.remove_source:
+                os.unlink(src)
+            self.job.progress(files=1)
+            self._release(parent)
+        else:
+            raise OSError(errno.EOPNOTSUPP, 'Cannot copy a socket or device file', src)
+
+    def _copy_dir(self, node):
+        self.job.check()
+        os.mkdir(node.dst)
+        if _scandir is None:
+            entries = [ (name, os.lstat(join(node.src, name))) for name in os.listdir(node.src) ]
+        else:
+            entries = [ (de.name, de.stat(follow_symlinks=False)) for de in _scandir(node.src) ]
+        with self.lock:
+            node.pending += len(entries)
+        for name, st in entries:
+            self._entry(node, join(node.src, name), join(node.dst, name), st)
+        self._release(node)
+
+    def _copy_file(self, parent, src, dst):
+        copy_file(self.job, src, dst, self.remove_source)
+        self._release(parent)
+
+    def _release(self, node):
+        """
+        Called when one of the things `node` was waiting on has finished.
+        """
+        while node:
+            with self.lock:
+                node.pending -= 1
+                if node.pending:
+                    return
+            if node is self.root:
+                self.finish()
+                return
+            shutil.copystat(node.src, node.dst)
+            if self.remove_source:
+                os.rmdir(node.src)
+            self.job.progress(files=1)
+            node = node.parent
+
+
+def copy(job, paths, target, workers=1):
+    """
+    Copies the files and directories in `paths` into the directory `target`.
+    """
+    pairs = []
+    for path in paths:
+        path = path.rstrip(os.sep)
+        if isdir(path) and not islink(path):
+            inside = os.path.realpath(target) + os.sep
+            if inside.startswith(os.path.realpath(path) + os.sep):
+                raise OSError(errno.EINVAL, 'Cannot copy a directory into itself', path)
+        pairs.append((path, join(target, basename(path))))
+
+    ParallelCopy(job, workers).run(pairs)
+
+
+def move(job, paths, target, workers=1):
+    """
+    Moves the files and directories in `paths` into the directory `target`.
+
+    Everything on the same filesystem as `target` is renamed.  The rest, and anything the
+    rename refuses with EXDEV, is copied by a ParallelCopy that deletes each source file as
+    soon as its copy is verified.
+    """
+    target_dev = os.stat(target).st_dev
+
+    renames = []
+    copies  = []
+    for path in paths:
+        dst = join(target, basename(path.rstrip(os.sep)))
+        if os.lstat(path).st_dev == target_dev:
+            renames.append((path, dst))
+        else:
+            copies.append((path, dst))
+
+    job.add_total(files=len(renames))
+    for src, dst in renames:
+        job.check()
+        # Unlike shutil.move, rename would silently replace an existing file.
+        if os.path.lexists(dst):
+            raise OSError(errno.EEXIST, 'Destination path already exists', dst)
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            # Bind mounts and overlays can share a device number with the target and still
+            # refuse to rename across them.
+            if e.errno != errno.EXDEV:
+                raise
+            job.add_total(files=-1)
+            copies.append((src, dst))
+            continue
+        job.progress(files=1)
+
+    if copies:
+        ParallelCopy(job, workers, remove_source=True).run(copies)
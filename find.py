@@ -0,0 +1,102 @@
+"""
+Recursive find.
+
+A Search walks a directory tree on a pool of threads, collecting the entries that match a
+query (see query.py).  It runs as a background job so it can be cancelled, and the view
+showing the results is updated with the matches found so far while it runs.
+"""
+
+import os
+from os.path import join
+
+from .fileops import Engine
+from .scan import from_direntry
+
+
+class Search(Engine):
+    """
+    Finds the entries under `root` for which `test` returns True, stopping after `limit`.
+
+    Entries are tested with their own name and are stored with their path relative to `root`.
+    """
+    def __init__(self, job, workers, root, test, limit, stat=False, previous=None):
+        Engine.__init__(self, job, workers)
+        self.root  = root
+        self.test  = test
+        self.limit = limit
+
+        self.stat = stat
+        # True to read the lstat data of every match, for the long format.  Entries are always
+        # stat'ed if the query needs it.
+
+        self.previous = previous
+        # The model the results view showed before the search, whose marks carry over to the
+        # results.
+
+        self.results = []
+        # The matching entries in the order they were found.  Only ever appended to, so a
+        # reader can take the new ones by length.
+
+        self.truncated = False
+        # True if the search stopped at `limit`.
+
+        self.pending = 0
+        # Directories queued or being scanned.
+
+    def run(self):
+        self.pending = 1
+        self._submit(self._scan, '')
+        self.wait()
+
+    def _scan(self, rel):
+        if not self.done.is_set():
+            self.job.check()
+            self._search(rel)
+
+        with self.lock:
+            self.pending -= 1
+            if not self.pending:
+                self.finish()
+
+    def _search(self, rel):
+        try:
+            entries = list(os.scandir(join(self.root, rel)))
+        except OSError:
+            # Skip directories we can't read, like find does (but quietly).
+            return
+        self.job.progress(files=len(entries))
+
+        subdirs = []
+        for de in entries:
+            entry = from_direntry(de)
+            if self.test.needs_stat:
+                _stat(entry, de)
+
+            if self.test(entry):
+                if self.stat and entry.st is None:
+                    _stat(entry, de)
+                entry.name = join(rel, entry.name)
+                with self.lock:
+                    if len(self.results) >= self.limit:
+                        self.truncated = True
+                        self.finish()
+                        return
+                    self.results.append(entry)
+
+            try:
+                if de.is_dir(follow_symlinks=False):
+                    subdirs.append(join(rel, de.name))
+            except OSError:
+                pass
+
+        with self.lock:
+            self.pending += len(subdirs)
+        for subdir in subdirs:
+            self._submit(self._scan, subdir)
+
+
+def _stat(entry, de):
+    try:
+        entry.st = de.stat(follow_symlinks=False)
+    except OSError:
+        entry.st = False
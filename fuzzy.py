@@ -0,0 +1,101 @@
+"""
+Fuzzy name matching for dired_jumpto_name.
+
+A query matches a name if its characters appear in the name in order, ignoring case.  Matches
+are ranked so an exact name beats a prefix, a prefix beats a substring starting a word, which
+beats any other substring, and scattered characters score best when they start words or follow
+each other.  Shorter names win ties.
+
+A Matcher is built once per listing and filters it incrementally as the query is typed: when
+the query grows only the names that matched the shorter query are tested again, and when it
+shrinks the results for the shorter query are reused.
+"""
+
+import os, re, heapq
+
+SEPARATORS = frozenset('._- ' + os.sep)
+# Characters that end a word.  A capital following a lowercase letter also starts a word.
+
+
+class Matcher:
+    def __init__(self, names):
+        self.names  = names
+        self.folded = [ name.lower() for name in names ]
+
+        self._stack = [ ('', None) ]
+        # The queries typed so far, each with the indexes of the names that match it.  None
+        # for the empty query, which matches everything.
+
+    def match(self, query, limit=None):
+        """
+        Returns the indexes of the names matching `query`, best first.  If `limit` is given
+        only the best `limit` are returned.
+        """
+        query = query.lower()
+        indexes = self._filter(query)
+
+        folded = self.folded
+        names  = self.names
+        def key(i):
+            return (score(names[i], folded[i], query), -len(folded[i]), -i)
+
+        if limit is None:
+            return sorted(indexes, key=key, reverse=True)
+        return heapq.nlargest(limit, indexes, key=key)
+
+    def _filter(self, query):
+        # Drop the queries this one doesn't extend, e.g. after a backspace or a paste.
+        while not query.startswith(self._stack[-1][0]):
+            self._stack.pop()
+
+        last, indexes = self._stack[-1]
+        if query == last:
+            return (indexes is None) and range(len(self.names)) or indexes
+
+        search = re.compile('.*?'.join(re.escape(c) for c in query)).search
+        folded = self.folded
+        if indexes is None:
+            indexes = [ i for (i, name) in enumerate(folded) if search(name) ]
+        else:
+            indexes = [ i for i in indexes if search(folded[i]) ]
+        self._stack.append((query, indexes))
+        return indexes
+
+
+def score(name, folded, query):
+    """
+    Returns the rank of `name` for `query`, higher being better.  `folded` is the name in lower
+    case and `query` must already be.  The name must match.
+    """
+    if folded == query:
+        return 1000
+
+    pos = folded.find(query)
+    if pos == 0:
+        return 800 + len(query)
+    if pos > 0:
+        return (word_start(name, pos) and 600 or 400) + len(query)
+
+    # The characters are scattered.  Take each at its first place after the last one.
+    total = 0
+    last = -2
+    for c in query:
+        pos = folded.find(c, last + 1)
+        if word_start(name, pos):
+            total += 10
+        elif pos == last + 1:
+            total += 5
+        else:
+            total += 1
+        last = pos
+    return min(total, 399)
+
+
+def word_start(name, pos):
+    """
+    Returns True if a word of `name` starts at `pos`.
+    """
+    if pos == 0:
+        return True
+    before = name[pos - 1]
+    return before in SEPARATORS or (before.islower() and name[pos].isupper())
@@ -0,0 +1,139 @@
+"""
+Per-view navigation history.
+
+When a view moves to another directory, a Snapshot of what it showed is pushed onto the view's
+back stack: the model (entries, marks, expanded subdirectories), the selection and scroll
+position, and the display modes.  Going back or forward restores a snapshot without reading
+the directory.  If the directory has changed since its listing was read, the view is then
+refreshed, which patches the restored listing with the differences.
+
+Snapshots hold whole listings, so besides the number kept per view the history of all views
+together is limited to `history_max_mb`, estimated as the listing cache does.  The oldest
+snapshots are dropped first.
+"""
+
+import itertools
+
+import sublime
+from sublime_plugin import EventListener
+
+from .cache import stamp, ENTRY_BYTES
+from . import model
+
+MAX_HISTORY = 50
+# The number of snapshots kept in each direction per view.
+
+numbers = itertools.count()
+# Numbers snapshots in the order they were taken.
+
+MODES = ('dired_long', 'dired_du', 'dired_sort', 'dired_sort_reverse', 'dired_dirs_first')
+# The view settings restored with a snapshot.
+
+back = {}
+forward = {}
+# Maps from view id to its list of Snapshots, most recent last.
+
+
+class Snapshot:
+    __slots__ = ('path', 'model', 'sel', 'viewport', 'modes', 'number', 'size')
+
+    def __init__(self, view, m):
+        self.path  = view.settings().get('dired_path')
+        self.model = m
+        self.sel   = [ (r.a, r.b) for r in view.sel() ]
+        self.viewport = view.viewport_position()
+
+        self.modes = { key: view.settings().get(key) for key in MODES
+                       if view.settings().has(key) }
+
+        self.number = next(numbers)
+        self.size = sum(ENTRY_BYTES + len(entry.name) for entry in _entries(m))
+
+    def stale(self):
+        """
+        Returns True if the directory has changed since the model's listing was read.
+        """
+        try:
+            return self.model.stamp is None or stamp(self.path) != self.model.stamp
+        except OSError:
+            return True
+
+
+def snapshot(view):
+    """
+    Returns a Snapshot of the directory `view` shows, or None if it has nothing to restore.
+    """
+    m = model.get(view)
+    settings = view.settings()
+    if (not m or m.path != settings.get('dired_path') or settings.get('dired_find') or
+            settings.get('dired_rename_mode')):
+        return None
+    return Snapshot(view, m)
+
+
+def push(view):
+    """
+    Records the directory `view` shows before it moves to another one.  This clears the
+    forward history.
+    """
+    snap = snapshot(view)
+    if snap:
+        _append(back, view.id(), snap)
+        forward.pop(view.id(), None)
+
+
+def peek(view):
+    """
+    Returns the path going back would return to, or None.
+    """
+    stack = back.get(view.id())
+    return stack and stack[-1].path or None
+
+
+def step(view, forwards=False):
+    """
+    Moves through the history of `view`, returning the Snapshot to show or None if there is
+    nothing in that direction.  The directory shown now is pushed the other way.
+    """
+    source, target = forwards and (forward, back) or (back, forward)
+    stack = source.get(view.id())
+    if not stack:
+        return None
+    snap = stack.pop()
+    current = snapshot(view)
+    if current:
+        _append(target, view.id(), current)
+    return snap
+
+
+def _append(stacks, view_id, snap):
+    stack = stacks.setdefault(view_id, [])
+    stack.append(snap)
+    del stack[:-MAX_HISTORY]
+    _trim()
+
+
+def _entries(m):
+    # The entries a model holds: its listing and the entries of its subdirectories, which are
+    # copies.
+    yield from m.listing
+    for children in m.children.values():
+        yield from children
+
+
+def _trim():
+    """
+    Drops the oldest snapshots of any view until the history fits in `history_max_mb`.
+    """
+    limit = sublime.load_settings('dired.sublime-settings').get('history_max_mb', 32) * 1024 * 1024
+    stacks = [ stack for stacks in (back, forward) for stack in stacks.values() ]
+    total = sum(snap.size for stack in stacks for snap in stack)
+    while total > limit:
+        oldest = min((stack for stack in stacks if stack), key=lambda stack: stack[0].number)
+        total -= oldest.pop(0).size
+
+
+class DiredHistoryEventListener(EventListener):
+    def on_close(self, view):
+        back.pop(view.id(), None)
+        forward.pop(view.id(), None)
@@ -0,0 +1,271 @@
+"""
+Runs long file operations (delete, move, copy) in the background.
+
+Jobs run on a small thread pool.  A job holds a lock on each directory it modifies, so two
+jobs touching the same directory run one after the other.  Jobs that only read, like disk
+usage walks and finds, have a pool of their own so a long walk doesn't hold up a delete.
+While jobs are running their progress is shown in the status bar, and when a job finishes
+the dired views of the directories it touched are refreshed.
+"""
+
+import threading, time, traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import sublime
+from sublime_plugin import WindowCommand
+
+from .cache import normalize
+from . import registry
+
+STATUS_INTERVAL = 500
+# Milliseconds between status bar updates.
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    A background operation.
+
+    The work function is called on a worker thread with the job as its only argument.  It
+    should call `add_total` if it knows how much there is to do, `progress` as it goes, and
+    `check` often enough for cancellation to be prompt.
+    """
+    def __init__(self, title, dirs, work):
+        self.title = title
+
+        self.dirs = sorted(set(normalize(d) for d in dirs))
+        # The directories modified by the job.  These are locked while it runs and refreshed
+        # afterwards.
+
+        self.work = work
+
+        self.files = 0
+        self.bytes = 0
+        self.total_files = 0
+        self.total_bytes = 0
+        self.started = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def add_total(self, files=0, bytes=0):
+        with self.lock:
+            self.total_files += files
+            self.total_bytes += bytes
+
+    def progress(self, files=0, bytes=0):
+        with self.lock:
+            self.files += files
+            self.bytes += bytes
+
+    def check(self):
+        """
+        Raises JobCancelled if the job has been cancelled.
+        """
+        if self.cancelled:
+            raise JobCancelled()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def status(self):
+        """
+        Returns a one-line description of the job's progress.
+        """
+        if self.started is None:
+            return '{}: waiting'.format(self.title)
+
+        with self.lock:
+            files, total_files = self.files, self.total_files
+            done, total = self.bytes, self.total_bytes
+
+        text = '{}: {} files'.format(self.title, files)
+        if total_files:
+            text = '{}: {}/{} files'.format(self.title, files, total_files)
+        if total:
+            text += ', {}/{}'.format(size(done), size(total))
+
+        # Estimate the time left from bytes if we have them, otherwise from files.
+        if not total:
+            done, total = files, total_files
+        elapsed = time.time() - self.started
+        if total and done and elapsed > 1:
+            text += ', ETA {}'.format(duration(elapsed * (total - done) / done))
+        return text
+
+
+def size(n):
+    for unit in ('B', 'KB', 'MB', 'GB', 'TB'):
+        if n < 1024 or unit == 'TB':
+            break
+        n /= 1024.0
+    return (unit == 'B') and '{} B'.format(n) or '{:.1f} {}'.format(n, unit)
+
+
+def duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '{}:{:02}:{:02}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return '{}:{:02}'.format(seconds // 60, seconds % 60)
+
+
+class Scheduler:
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.pool = None
+        self.lock = threading.Lock()
+
+        self.jobs = []
+        # Jobs that are queued or running.
+
+        self.dir_locks = {}
+        # Map from normalized directory to the lock held by the job modifying it.
+
+    def submit(self, job):
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers)
+            self.jobs.append(job)
+            for d in job.dirs:
+                self.dir_locks.setdefault(d, threading.Lock())
+        self.pool.submit(self._run, job)
+        _tick()
+
+    def active(self):
+        with self.lock:
+            return list(self.jobs)
+
+    def shutdown(self):
+        for job in self.active():
+            job.cancel()
+        if self.pool:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def _run(self, job):
+        # Locks are always taken in sorted order so jobs sharing directories can't deadlock.
+        locks = [ self.dir_locks[d] for d in job.dirs ]
+        for lock in locks:
+            lock.acquire()
+
+        error = None
+        try:
+            job.check()
+            job.started = time.time()
+            job.work(job)
+        except JobCancelled:
+            error = 'cancelled'
+        except (OSError, IOError) as e:
+            error = str(e)
+        except Exception as e:
+            # A bug, but the job must still finish and report it.
+            traceback.print_exc()
+            error = repr(e)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+            with self.lock:
+                self.jobs.remove(job)
+
+        sublime.set_timeout(lambda: self._finished(job, error), 0)
+
+    def _finished(self, job, error):
+        refresh_dirs(job.dirs)
+        if error == 'cancelled':
+            sublime.status_message('{}: cancelled'.format(job.title))
+        elif error:
+            sublime.error_message('{} failed:\n\n{}'.format(job.title, error))
+        else:
+            sublime.status_message('{}: done'.format(job.title))
+
+
+
+scheduler = Scheduler()
+# Runs the jobs that modify files.
+
+readers = Scheduler()
+# Runs the jobs that only read, which lock no directories.
+
+ticking = False
+
+
+def active():
+    """
+    Returns the queued and running jobs of both schedulers.
+    """
+    return scheduler.active() + readers.active()
+
+
+def _tick():
+    """
+    Shows the progress of the running jobs every STATUS_INTERVAL until there are none.
+    """
+    global ticking
+    if ticking:
+        return
+    ticking = True
+
+    def _update():
+        global ticking
+        jobs = active()
+        if not jobs:
+            ticking = False
+            return
+        sublime.status_message(' | '.join(job.status() for job in jobs))
+        sublime.set_timeout(_update, STATUS_INTERVAL)
+
+    sublime.set_timeout(_update, 0)
+
+
+def submit(title, dirs, work):
+    """
+    Runs `work(job)` in the background.  `dirs` are the directories it modifies.
+    """
+    job = Job(title, dirs, work)
+    scheduler.submit(job)
+    return job
+
+
+def refresh_dirs(dirs):
+    """
+    Refreshes every dired view displaying one of the directories `dirs`, which must be
+    normalized.
+    """
+    for path in set(dirs):
+        for view in registry.views(path):
+            if not view.settings().get('dired_rename_mode'):
+                view.run_command('dired_refresh')
+
+
+class DiredCancelJobCommand(WindowCommand):
+    """
+    Cancels a running background job, prompting for which one if there are several.
+    """
+    def run(self):
+        jobs = active()
+        if not jobs:
+            sublime.status_message('No background jobs')
+            return
+
+        if len(jobs) == 1:
+            jobs[0].cancel()
+            return
+
+        def on_done(select):
+            if select != -1:
+                jobs[select].cancel()
+
+        self.window.show_quick_panel([ job.status() for job in jobs ], on_done)
+
+
+def plugin_loaded():
+    settings = sublime.load_settings('dired.sublime-settings')
+    scheduler.workers = settings.get('job_workers', 2)
+    readers.workers   = settings.get('read_job_workers', 2)
+
+
+def plugin_unloaded():
+    scheduler.shutdown()
+    readers.shutdown()
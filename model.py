@@ -0,0 +1,322 @@
+"""
+The in-memory listing behind each dired view.
+
+Directories with more entries than the virtual_threshold setting are rendered a page at a
+time.  The model holds the complete sorted listing, which part of it is in the view, and the
+marks.  The view's 'marked' regions only reflect the model.
+"""
+
+import os
+from os.path import join, basename
+
+import sublime
+from sublime_plugin import EventListener
+
+from . import columns, du, fuzzy, order
+from .render import find
+from .scan import Entry
+
+models = {}
+# Map from view id to its Model.
+
+
+def settings():
+    return sublime.load_settings('dired.sublime-settings')
+
+
+class Model:
+    def __init__(self, path, entries, stamp=None):
+        self.path = path
+
+        self.entries = entries
+        # Every entry in the directory, in display order, followed by the entries of the
+        # expanded subdirectories.  Those are named by their path relative to `path`.
+
+        self.listing = entries
+        # The entries of the directory itself.
+
+        self.expanded = set()
+        # The relative paths of the subdirectories expanded inline.
+
+        self.indent = True
+        # True to show the entries of expanded subdirectories indented by depth.  False to show
+        # every entry by its relative path, as for find results.
+
+        self.sorted = True
+        # False if the entries are not in name order.
+
+        self.order = order.DEFAULT
+        # The (mode, reverse, dirs_first) the listing and subdirectories are sorted in.  See
+        # order.py.
+
+        self.children = {}
+        # Map from the relative path of each subdirectory that has been expanded to its
+        # entries.  They are kept when it is collapsed so it can be expanded again at once.
+
+        self.start = 0
+        self.end   = len(entries)
+        # The range of entries rendered in the view.
+
+        self.marked = set()
+        # Indexes of the marked entries.
+
+        self.long = False
+        # True to render entries in the long format (see columns.py).
+
+        self.usage = None
+        self.largest = 0
+        # In disk usage mode, a map from each entry's name to the bytes it uses (None if not
+        # known yet) and the largest of them.  See du.py.
+
+        self.version = 0
+        # Incremented when the text of rendered entries changes without the range changing,
+        # e.g. when columns.resolve fills in owners.
+
+        self.stamp = stamp
+        # The directory's cache.stamp when `entries` were read, to tell if it has changed
+        # since, or None if not known.
+
+        try:
+            self.dev = os.stat(path).st_dev
+        except OSError:
+            self.dev = 0
+
+        self._lines = None
+        self._offsets = None
+        # Cached results of lines() and offsets() and what they were computed for.
+
+        self._index = None
+        # Map from name to index, built on first use.
+
+        self._matcher = None
+        # The fuzzy.Matcher over the entries' names, built on first use.
+
+    @property
+    def virtual(self):
+        """
+        True if only part of the listing is rendered.
+        """
+        return self.start > 0 or self.end < len(self.entries)
+
+    def window(self, index):
+        """
+        Returns the (start, end) range of a page of entries centered on `index`.
+        """
+        page  = settings().get('virtual_page_size', 2000)
+        start = max(0, index - page // 2)
+        end   = min(len(self.entries), start + page)
+        return (max(0, end - page), end)
+
+    def rendered(self):
+        """
+        Returns the entries rendered in the view.  Rendered entry `row` is on line `row + 2`.
+        """
+        return self.entries[self.start:self.end]
+
+    def line(self, entry):
+        """
+        Returns the text of the line displaying `entry`.
+        """
+        label = entry.text
+        if self.indent and os.sep in entry.name:
+            # In an expanded subdirectory.
+            label = '  ' * entry.name.count(os.sep) + basename(entry.name) + label[len(entry.name):]
+
+        if self.usage is not None:
+            return du.line(self, entry, label)
+        return self.long and columns.line(entry, label) or label
+
+    def lines(self):
+        """
+        Returns the text of each rendered line.
+        """
+        key = (self.start, self.end, self.long, self.version)
+        if self._lines is None or self._lines[0] != key:
+            self._lines = (key, [ self.line(entry) for entry in self.rendered() ])
+        return self._lines[1]
+
+    def offsets(self):
+        """
+        Returns the offset of each rendered line from the start of the first one, followed by
+        the offset just past the last one.
+        """
+        lines = self.lines()
+        if self._offsets is None or self._offsets[0] is not lines:
+            offsets = [ 0 ]
+            pos = 0
+            for line in lines:
+                pos += len(line) + 1
+                offsets.append(pos)
+            self._offsets = (lines, offsets)
+        return self._offsets[1]
+
+    def index(self):
+        """
+        Returns a dictionary mapping each entry's name to its index.
+        """
+        if self._index is None:
+            self._index = { entry.name: i for (i, entry) in enumerate(self.entries) }
+        return self._index
+
+    def matcher(self):
+        """
+        Returns a fuzzy.Matcher over the entries' names.  The indexes it returns are indexes into
+        `entries`.
+        """
+        if self._matcher is None:
+            self._matcher = fuzzy.Matcher([ entry.name for entry in self.entries ])
+        return self._matcher
+
+    def find(self, name):
+        """
+        Returns the index of the entry named `name`, or None if there isn't one.
+        """
+        if self.sorted:
+            return find(self.entries, name)
+        return self.index().get(name)
+
+    def expand(self, name, children=None):
+        """
+        Shows the entries of the subdirectory `name`, a relative path, below it.
+
+        children
+            The subdirectory's entries, if they have just been read.  Otherwise the entries
+            read when it was last expanded are shown.
+        """
+        if children is not None:
+            children = [ _child(name, entry) for entry in children ]
+            if self.order != order.DEFAULT:
+                children = order.sort(self.path, children, *self.order)
+            self.children[name] = children
+        if name in self.children and name in self.index():
+            self.expanded.add(name)
+            self._flatten()
+
+    def sort(self, mode='name', reverse=False, dirs_first=False):
+        """
+        Sorts the listing and the subdirectories that have been expanded.  Nothing is read
+        from disk: sizes and times come from the entries' lstat data (see `unstated`).
+        """
+        if (mode, reverse, dirs_first) == self.order:
+            return
+        self.order = (mode, reverse, dirs_first)
+
+        self.listing = order.sort(self.path, self.listing, *self.order)
+        for name, children in self.children.items():
+            self.children[name] = order.sort(self.path, children, *self.order)
+        self._flatten()
+
+    def append(self, entries):
+        """
+        Adds `entries` to the end of the listing and renders them, for find results as they
+        are found.
+        """
+        self.entries.extend(entries)
+        self.end = len(self.entries)
+        self._index = None
+        self._matcher = None
+
+    def unstated(self):
+        """
+        Returns the entries, including those of collapsed subdirectories, whose lstat data
+        hasn't been read yet.
+        """
+        result = [ entry for entry in self.listing if entry.st is None ]
+        for children in self.children.values():
+            result.extend(entry for entry in children if entry.st is None)
+        return result
+
+    def collapse(self, name):
+        """
+        Hides the entries of the subdirectory `name` and of the subdirectories in it.
+        """
+        prefix = name + os.sep
+        self.expanded = set(n for n in self.expanded if n != name and not n.startswith(prefix))
+        self._flatten()
+
+    def _flatten(self):
+        # Marks are indexes, so they are carried over by name.
+        marked = [ self.entries[i].name for i in self.marked ]
+
+        entries = []
+        def add(items):
+            for entry in items:
+                entries.append(entry)
+                if entry.is_dir and entry.name in self.expanded:
+                    add(self.children[entry.name])
+        add(self.listing)
+
+        self.entries = entries
+        self.start, self.end = 0, len(entries)
+        self.sorted = not self.expanded and self.order == order.DEFAULT
+        self.version += 1
+        self._index = None
+        self._matcher = None
+
+        index = self.index()
+        self.marked = set(index[name] for name in marked if name in index)
+
+    def key(self, entry):
+        """
+        Returns a key that identifies the file `entry` refers to even after it is renamed.
+        """
+        return entry.ino and (self.dev, entry.ino) or entry.name
+
+    def marked_rows(self):
+        """
+        Returns the sorted rows of the marked entries that are rendered.
+        """
+        return sorted(i - self.start for i in self.marked if self.start <= i < self.end)
+
+    def inherit_marks(self, old):
+        """
+        Marks the entries that were marked in `old`, an earlier model of the same directory.
+        Entries are matched by (st_dev, st_ino) so marks follow files renamed in the meantime.
+        """
+        if not old.marked or old.path != self.path:
+            return
+
+        names = self.index()
+        keys  = { self.key(entry): i for (i, entry) in enumerate(self.entries) }
+
+        for i in old.marked:
+            entry = old.entries[i]
+            key   = old.key(entry)
+            index = names.get(entry.name)
+            if index is None or self.key(self.entries[index]) != key:
+                # Renamed, or the name now refers to a different file.  If the file is gone,
+                # keep the mark on whatever has its name.
+                index = keys.get(key, index)
+            if index is not None:
+                self.marked.add(index)
+
+
+def _child(name, entry):
+    """
+    Returns a copy of `entry`, from the subdirectory `name`, named by its path relative to the
+    model's directory.
+    """
+    child = Entry(join(name, entry.name), entry.is_dir, entry.is_link, entry.ino)
+    child.st = entry.st
+    child.target = entry.target
+    return child
+
+
+def wants_virtual(count):
+    """
+    Returns True if a directory with `count` entries should be rendered a page at a time.
+    """
+    return count > settings().get('virtual_threshold', 20000)
+
+
+def get(view):
+    return models.get(view.id())
+
+
+def put(view, model):
+    models[view.id()] = model
+
+
+class DiredModelEventListener(EventListener):
+    def on_close(self, view):
+        models.pop(view.id(), None)
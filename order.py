@@ -0,0 +1,89 @@
+"""
+Sort orders.
+
+Listings are read and cached in name order (see render.sort_key), which is the default.  The
+other orders sort a model's entries in memory with keys that are computed once per entry and
+kept on it.  Entries are shared through the listing cache, so switching order, or refreshing a
+view of a directory that hasn't changed, neither reads the directory nor computes keys again.
+Sizes and times come from the lstat data cached on the entries, which must be read first (see
+scan.stat_entries).  Entries without it sort last.
+
+    name        by name, ignoring case
+    natural     by name with runs of digits compared as numbers, so file2 comes before file10
+    extension   by extension, then name
+    size        largest first
+    mtime       most recently modified first
+
+Any order can be reversed and can list directories first.
+"""
+
+import re
+from os.path import basename, splitext
+
+from .render import sort_key
+
+RE_DIGITS = re.compile(r'(\d+)')
+
+DEFAULT = ('name', False, False)
+# The (mode, reverse, dirs_first) listings are read in.
+
+
+def natural_key(name):
+    # Splitting on a group alternates text and digits, so parts at the same position always
+    # have the same type.
+    parts = RE_DIGITS.split(name.lower())
+    return (tuple((int(part) if i % 2 else part) for (i, part) in enumerate(parts)), name)
+
+
+def _size(entry):
+    # Files that couldn't be stat'ed go last.
+    size = (-entry.st.st_size if entry.st else 1)
+    return (size, sort_key(basename(entry.name)))
+
+
+def _mtime(entry):
+    mtime = (-entry.st.st_mtime if entry.st else float('inf'))
+    return (mtime, sort_key(basename(entry.name)))
+
+
+KEYS = {
+    'name':      lambda entry: sort_key(basename(entry.name)),
+    'natural':   lambda entry: natural_key(basename(entry.name)),
+    'extension': lambda entry: (splitext(entry.name)[1].lower(), sort_key(basename(entry.name))),
+    'size':      _size,
+    'mtime':     _mtime
+}
+
+NEEDS_STAT = ('size', 'mtime')
+
+
+def key(entry, mode):
+    """
+    Returns the sort key of `entry` for `mode`, computing it the first time.
+
+    Size and time keys aren't kept until the entry has been stat'ed, or the key putting it last
+    would stick after the stat arrives.
+    """
+    if mode in NEEDS_STAT and not entry.st:
+        return KEYS[mode](entry)
+    keys = entry.keys
+    if keys is None:
+        keys = entry.keys = {}
+    value = keys.get(mode)
+    if value is None:
+        value = keys[mode] = KEYS[mode](entry)
+    return value
+
+
+def sort(path, entries, mode='name', reverse=False, dirs_first=False):
+    """
+    Returns a new list of the entries of the directory `path` in the given order.
+    """
+    if mode not in KEYS:
+        mode = 'name'
+
+    result = sorted(entries, key=lambda entry: key(entry, mode), reverse=reverse)
+    if dirs_first:
+        # The sort is stable, so each group stays in order.
+        result.sort(key=lambda entry: not entry.is_dir)
+    return result
@@ -0,0 +1,212 @@
+"""
+Preview scheduling.
+
+With preview on, moving the cursor doesn't preview every entry it passes over.  A preview is
+requested on each move but only shown once the cursor has been still for `preview_delay`
+milliseconds; a request superseded by a later move is dropped when its timer fires.
+
+After each preview the entries just before and after the cursor are read on a worker thread
+into a small cache, so stepping to them with n and p is fast: the listings of directories, and
+the first PREFETCH_BYTES of files.
+
+Files are previewed as text in a scratch view instead of being opened, so only the start (and
+optionally the end) of a huge file is read, through mmap.  Binary files are shown as a hex
+dump of their first HEX_BYTES.
+"""
+
+import os, stat, threading, mmap, mimetypes
+from collections import OrderedDict
+
+import sublime
+
+from .cache import listing
+from .columns import size as format_size, mtime as format_mtime
+
+PREFETCH_ITEMS = 8
+# The number of prefetched entries kept.
+
+PREFETCH_BYTES = 64 * 1024
+# How much of a file is read ahead.
+
+HEX_BYTES = 4096
+# How much of a binary file is shown.
+
+TEXT_CONTROLS = frozenset(b'\t\n\r\f\b\x1b')
+# Control characters that are common in text files.
+
+requests = {}
+# Map from view id to the number of its latest preview request.  Only that one is shown.
+
+
+def request(view_id, callback, delay):
+    """
+    Calls `callback()` on the main thread after `delay` milliseconds unless `request` or
+    `cancel` is called again for the same view before then.
+    """
+    number = requests.get(view_id, 0) + 1
+    requests[view_id] = number
+
+    def _fire():
+        if requests.get(view_id) == number:
+            del requests[view_id]
+            callback()
+
+    sublime.set_timeout(_fire, delay)
+
+
+def cancel(view_id):
+    requests.pop(view_id, None)
+
+
+class Prefetched:
+    """
+    An LRU cache of prefetched entries, validated by their mtime and size.  It is safe to use
+    from multiple threads.
+    """
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.lock  = threading.Lock()
+        self.items = OrderedDict()
+        # Map from path to (stamp, data) ordered from least to most recently used.  The data
+        # is the listing of a directory or the first bytes of a file.
+
+    def get(self, path, current):
+        with self.lock:
+            item = self.items.get(path)
+            if item is None or item[0] != current:
+                return None
+            self.items.move_to_end(path)
+            return item[1]
+
+    def put(self, path, current, data):
+        with self.lock:
+            self.items[path] = (current, data)
+            self.items.move_to_end(path)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+
+prefetched = Prefetched(PREFETCH_ITEMS)
+
+
+def _stamp(st):
+    return (st.st_mtime_ns, st.st_size)
+
+
+def cached(path):
+    """
+    Returns the prefetched data for `path` if it is still current, otherwise None.
+    """
+    try:
+        return prefetched.get(path, _stamp(os.stat(path)))
+    except OSError:
+        return None
+
+
+def prefetch(paths):
+    """
+    Reads `paths` into the cache on a worker thread, skipping those already cached.
+    """
+    def _run():
+        for path in paths:
+            try:
+                st = os.stat(path)
+                if prefetched.get(path, _stamp(st)) is not None:
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    data = listing(path)
+                elif stat.S_ISREG(st.st_mode):
+                    with open(path, 'rb') as f:
+                        data = f.read(PREFETCH_BYTES)
+                else:
+                    continue
+            except OSError:
+                continue
+            prefetched.put(path, _stamp(st), data)
+
+    sublime.set_timeout_async(_run, 0)
+
+
+def read(path, size, head_bytes, tail_bytes=0):
+    """
+    Returns the first `head_bytes` and the last `tail_bytes` of the file `path`, which is
+    `size` bytes long.  The tail is empty if it would overlap the head.
+    """
+    if not tail_bytes or size <= head_bytes + tail_bytes:
+        tail_bytes = 0
+        head = cached(path)
+        if head is not None and len(head) >= min(size, head_bytes):
+            return head[:head_bytes], b''
+
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Not mappable, e.g. empty or a file in /proc whose size isn't known.
+            head = f.read(head_bytes)
+            tail = b''
+            if tail_bytes:
+                f.seek(-tail_bytes, os.SEEK_END)
+                tail = f.read(tail_bytes)
+            return head, tail
+        with mapped:
+            # Only the pages sliced are read.
+            return mapped[:head_bytes], tail_bytes and mapped[-tail_bytes:] or b''
+
+
+def is_binary(data):
+    """
+    Returns True if `data`, the start of a file, doesn't look like text.
+    """
+    if b'\0' in data:
+        return True
+    controls = sum(1 for b in data if b < 32 and b not in TEXT_CONTROLS)
+    return controls > len(data) * 0.3
+
+
+def hexdump(data, offset=0):
+    """
+    Returns `data` formatted like `hexdump -C`.
+    """
+    lines = []
+    for i in range(0, len(data), 16):
+        chunk = data[i:i + 16]
+        text  = ''.join((32 <= b < 127) and chr(b) or '.' for b in chunk)
+        lines.append('{:08x}  {:<48} |{}|'.format(
+            offset + i, ' '.join('{:02x}'.format(b) for b in chunk), text))
+    return '\n'.join(lines)
+
+
+def file_text(path, head_bytes, tail_bytes=0):
+    """
+    Returns the text previewing the file `path`: a header with its size and type, then the
+    start of the file, and its end if `tail_bytes` is given.  Raises OSError if it can't be
+    read.
+    """
+    st = os.stat(path)
+    size = st.st_size
+    head, tail = read(path, size, head_bytes, tail_bytes)
+    binary = is_binary(head)
+
+    kind = binary and 'binary' or 'text'
+    mime = mimetypes.guess_type(path)[0]
+    if mime:
+        kind += ', ' + mime
+    header = '{}\n{} ({} bytes), {}, modified {}\n'.format(
+        path, format_size(size), size, kind, format_mtime(st.st_mtime))
+
+    if binary:
+        body = hexdump(head[:HEX_BYTES])
+        shown = min(size, HEX_BYTES)
+    else:
+        body = head.decode('utf-8', 'replace')
+        shown = len(head)
+        if tail:
+            skipped = size - len(head) - len(tail)
+            body += '\n\n[... {} skipped ...]\n\n'.format(format_size(skipped))
+            body += tail.decode('utf-8', 'replace')
+            shown = size
+    if shown < size:
+        body += '\n\n[... {} more ...]'.format(format_size(size - shown))
+
+    return header + '\n' + body
@@ -5,12 +5,115 @@
 import sublime
 from sublime import Region
 from sublime_plugin import WindowCommand, EventListener, TextCommand
-import os
+import os, threading
+from collections import OrderedDict
 from os.path import basename, join, isdir, dirname, expanduser
 
+from .cache import listing, normalize, stamp
+from .render import sort_key
+
 map_window_to_ctx = {}
 # Map from window id that is displaying a prompt to its prompt context object.
 
+MAX_TRIES = 200
+# The number of directories whose subdirectory names are kept for completion.
+
+tries = OrderedDict()
+# Map from normalized directory path to (stamp, Trie of its subdirectory names), least
+# recently used first.
+
+tries_lock = threading.Lock()
+# Held while updating `tries`, since directories are prefetched on a worker thread.
+
+
+class Trie:
+    """
+    A prefix tree of names.  Each node is a dict from a character to the next node, and a
+    name ends at the nodes with the key END.
+    """
+    END = ''
+
+    def __init__(self, names):
+        self.root = {}
+        for name in names:
+            node = self.root
+            for c in name:
+                node = node.setdefault(c, {})
+            node[Trie.END] = name
+
+    def _node(self, prefix):
+        node = self.root
+        for c in prefix:
+            node = node.get(c)
+            if node is None:
+                return None
+        return node
+
+    def names(self, prefix):
+        """
+        Returns the names starting with `prefix` in display order.
+        """
+        node = self._node(prefix)
+        if node is None:
+            return []
+        names = []
+        stack = [ node ]
+        while stack:
+            node = stack.pop()
+            for c, child in node.items():
+                if c == Trie.END:
+                    names.append(child)
+                else:
+                    stack.append(child)
+        return sorted(names, key=sort_key)
+
+    def complete(self, prefix):
+        """
+        Returns the longest prefix shared by the names starting with `prefix` and True if it
+        is the only such name.  Returns (None, False) if there are none.
+        """
+        node = self._node(prefix)
+        if not node:
+            return (None, False)
+        while len(node) == 1 and Trie.END not in node:
+            c, node = next(iter(node.items()))
+            prefix += c
+        return (prefix, len(node) == 1)
+
+
+def subdirectories(path):
+    """
+    Returns a Trie of the names of the subdirectories of `path`.  It is cached until the
+    directory's mtime changes.  Raises OSError if it cannot be read.
+    """
+    key = normalize(path)
+    current = stamp(path)
+    with tries_lock:
+        item = tries.get(key)
+        if item and item[0] == current:
+            tries.move_to_end(key)
+            return item[1]
+
+    trie = Trie(e.name for e in listing(path) if e.is_dir)
+    with tries_lock:
+        tries[key] = (current, trie)
+        tries.move_to_end(key)
+        while len(tries) > MAX_TRIES:
+            tries.popitem(last=False)
+    return trie
+
+
+def prefetch(path):
+    """
+    Reads the subdirectories of `path` on a worker thread so completing in it is immediate.
+    """
+    def _run():
+        try:
+            subdirectories(path)
+        except OSError:
+            pass
+    sublime.set_timeout_async(_run, 0)
+
 
 def start(msg, window, path, callback):
     """
@@ -20,6 +123,7 @@ def start(msg, window, path, callback):
         path += os.sep
     path = expanduser(path)
     map_window_to_ctx[window.id()] = PromptContext(msg, path, callback)
+    prefetch(path)
     window.run_command('dired_prompt')
 
 
@@ -86,22 +190,6 @@ class DiredCompleteCommand(WindowCommand):
     Since a prompt is already in progress, a completion info must already be registered for
     this window.  Update the path, kill the current prompt, and reprompt with the new path.
     """
-    def _needs_sep(self, path):
-        """
-        Returns True if the current value is a complete directory name without a trailing
-        separator, and there are no other possible completions.
-        """
-        if not isdir(path) or path.endswith(os.sep):
-            return False
-
-        partial = basename(path)
-        path    = dirname(path)
-        if any(n for n in os.listdir(dirname(path)) if n != partial and n.startswith(partial) and isdir(join(path, n))):
-            # There are other completions.
-            return False
-
-        return True
-
     def _parse_split(self, path):
         """
         Split the path into the directory to search and the prefix to match in that directory.
@@ -138,27 +226,34 @@ class DiredCompleteCommand(WindowCommand):
             print('Invalid:', ctx.path)
             return
 
-        completions = [ n for n in os.listdir(path) if n.startswith(prefix) and isdir(join(path, n)) ]
+        try:
+            trie = subdirectories(path)
+        except OSError as e:
+            sublime.status_message('Unable to read {}: {}'.format(path, e.strerror))
+            return
 
-        if len(completions) == 0:
+        common, unique = trie.complete(prefix)
+        if common is None:
             sublime.status_message('No matches')
             self._close_completions(ctx)
             return
 
-        if len(completions) == 1:
-            ctx.path = join(path, completions[0]) + os.sep
+        if unique:
+            ctx.path = join(path, common) + os.sep
+            # The next Tab will most likely complete in this directory.
+            prefetch(ctx.path)
             self.window.run_command('dired_prompt')
             self._close_completions(ctx)
             return
 
-        common = os.path.commonprefix(completions)
-        if common and common > prefix:
+        if common != prefix:
             ctx.path = join(path, common)
             self.window.run_command('dired_prompt')
             self._close_completions(ctx)
             return
 
         # There are multiple possibilities.  Display a completion view.
+        completions = trie.names(prefix)
 
         if not ctx.completion_view:
             ctx.completion_view = self.window.new_file()
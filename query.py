@@ -0,0 +1,119 @@
+"""
+Mark queries.
+
+A query is a list of space separated terms, all of which must match:
+
+    *.log *.txt     globs (any one of them must match the name)
+    re:^test_       a regular expression searched for in the name
+    size>1G         size comparisons using <, <=, >, >=, or =, with optional k, M, G, T units
+    age>30d         age of the modification time, with s, m, h, d, or w units (default d)
+    type:f          f for files, d for directories, l for symlinks
+
+Names are matched without the directory, so entries of expanded subdirectories match the
+same way as the files in the view's own directory.
+
+Queries are compiled once into a single function and run over the entries in the model.
+Sizes and times come from the stat data cached with the listing (see scan.stat_entries).
+"""
+
+import os, re, time, fnmatch, operator
+from os.path import basename
+
+RE_COMPARE = re.compile(r'^(size|age)(<=|>=|<|>|=)(\d+(?:\.\d+)?)([a-zA-Z]?)$')
+
+OPERATORS = {
+    '<':  operator.lt,
+    '<=': operator.le,
+    '>':  operator.gt,
+    '>=': operator.ge,
+    '=':  operator.eq
+}
+
+SIZE_UNITS = { '': 1, 'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4 }
+AGE_UNITS  = { '': 86400, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400 }
+
+
+class QueryError(Exception):
+    pass
+
+
+class Query:
+    """
+    A compiled query.  Call it with an Entry to test it.
+
+    needs_stat
+        True if the query uses sizes or times, in which case the entries must have been passed
+        to scan.stat_entries first.
+    """
+    def __init__(self, tests, needs_stat):
+        self.tests = tests
+        self.needs_stat = needs_stat
+
+    def __call__(self, entry):
+        for test in self.tests:
+            if not test(entry):
+                return False
+        return True
+
+
+def compile(text):
+    """
+    Returns a Query for the query string `text`.  Raises QueryError if it is invalid.
+    """
+    tests = []
+    globs = []
+    needs_stat = False
+
+    for term in text.split():
+        if term.startswith('re:'):
+            try:
+                regex = re.compile(term[3:])
+            except re.error as e:
+                raise QueryError('Invalid regular expression {}: {}'.format(term[3:], e))
+            tests.append(lambda entry, search=regex.search: search(basename(entry.name)) is not None)
+
+        elif term.startswith('type:'):
+            tests.append(_type_test(term[5:]))
+
+        elif RE_COMPARE.match(term):
+            what, op, number, unit = RE_COMPARE.match(term).groups()
+            units = (what == 'size') and SIZE_UNITS or AGE_UNITS
+            if unit.lower() not in units:
+                raise QueryError('Invalid unit in {}'.format(term))
+            limit = float(number) * units[unit.lower()]
+            tests.append(_compare_test(what, OPERATORS[op], limit))
+            needs_stat = True
+
+        else:
+            globs.append(fnmatch.translate(os.path.normcase(term)))
+
+    if globs:
+        # Combine the globs into a single regular expression.
+        match = re.compile('|'.join('(?:{})'.format(g) for g in globs)).match
+        normcase = os.path.normcase
+        tests.insert(0, lambda entry: match(normcase(basename(entry.name))) is not None)
+
+    if not tests:
+        raise QueryError('Empty query')
+
+    return Query(tests, needs_stat)
+
+
+def _type_test(kind):
+    if kind == 'f':
+        return lambda entry: not entry.is_dir and not entry.is_link
+    if kind == 'd':
+        return lambda entry: entry.is_dir
+    if kind == 'l':
+        return lambda entry: entry.is_link
+    raise QueryError('Invalid type {}: use f, d, or l'.format(kind))
+
+
+def _compare_test(what, op, limit):
+    if what == 'size':
+        return lambda entry: bool(entry.st) and op(entry.st.st_size, limit)
+
+    # Ages are compared as modification times so the clock is only read once.  An age greater
+    # than the limit is an mtime less than the cutoff.
+    cutoff = time.time() - limit
+    return lambda entry: bool(entry.st) and op(cutoff, entry.st.st_mtime)
@@ -0,0 +1,147 @@
+"""
+A registry of dired views.
+
+Finding the view showing a directory used to mean reading the settings of every view in the
+window, which is slow with hundreds of tabs.  The registry maps each directory to the ids of
+the views showing it, updated as views are shown, reloaded, and closed.
+
+It also keeps the order dired views were last activated in.  If `max_dired_views` is set,
+opening a view past the limit closes the least recently used dired views that aren't visible.
+"""
+
+from collections import OrderedDict
+
+import sublime
+from sublime_plugin import EventListener
+
+from .cache import normalize
+
+by_path = {}
+# Map from normalized directory path to the set of ids of the views showing it.
+
+paths = {}
+# Map from view id to the normalized path it is registered under.
+
+recent = OrderedDict()
+# The ids of registered views, least recently activated first.
+
+
+def register(view, path):
+    """
+    Records that `view` now shows the directory `path`.
+    """
+    view_id = view.id()
+    unregister(view_id)
+    key = normalize(path)
+    paths[view_id] = key
+    by_path.setdefault(key, set()).add(view_id)
+    recent[view_id] = True
+
+
+def unregister(view_id):
+    key = paths.pop(view_id, None)
+    if key is not None:
+        ids = by_path[key]
+        ids.discard(view_id)
+        if not ids:
+            del by_path[key]
+    recent.pop(view_id, None)
+
+
+def views(path):
+    """
+    Returns the valid views showing the directory `path` in any window.
+    """
+    result = []
+    for view_id in list(by_path.get(normalize(path), ())):
+        view = sublime.View(view_id)
+        if view.is_valid():
+            result.append(view)
+        else:
+            unregister(view_id)
+    return result
+
+
+def find(window, path, test=None):
+    """
+    Returns a view in `window` showing the directory `path` for which `test(view)` is true, or
+    None.
+    """
+    for view in views(path):
+        if view.window() == window and (test is None or test(view)):
+            return view
+    return None
+
+
+def get(window, view_id):
+    """
+    Returns the view `view_id` if it is still open in `window`, otherwise None.
+    """
+    if not view_id:
+        return None
+    view = sublime.View(view_id)
+    if view.is_valid() and view.window() == window:
+        return view
+    return None
+
+
+def trim(window, keep):
+    """
+    Closes the least recently used dired views of `window` that aren't visible until there
+    are no more than `max_dired_views`.  The view `keep` is never closed.
+    """
+    limit = sublime.load_settings('dired.sublime-settings').get('max_dired_views', 0)
+    if not limit:
+        return
+
+    candidates = []
+    for view_id in list(recent):
+        view = sublime.View(view_id)
+        if not view.is_valid():
+            unregister(view_id)
+        elif view.window() == window:
+            candidates.append(view)
+
+    excess = len(candidates) - limit
+    for view in candidates:
+        if excess <= 0:
+            break
+        if view == keep or not closable(view):
+            continue
+        window.focus_view(view)
+        window.run_command('close_file')
+        unregister(view.id())
+        excess -= 1
+
+    window.focus_view(keep)
+
+
+def closable(view):
+    """
+    Returns True if `view` can be closed without losing anything: a dired view that isn't in
+    rename mode and isn't the one shown in its group.
+    """
+    settings = view.settings()
+    if not view.is_scratch() or settings.get('dired_rename_mode') or view.is_dirty():
+        return False
+    window = view.window()
+    group, _ = window.get_view_index(view)
+    return window.active_view_in_group(group) != view
+
+
+class DiredRegistryEventListener(EventListener):
+    def on_activated(self, view):
+        if view.id() in recent:
+            recent.move_to_end(view.id())
+
+    def on_close(self, view):
+        unregister(view.id())
+
+
+def plugin_loaded():
+    # Register the views restored from the last session.
+    for window in sublime.windows():
+        for view in window.views():
+            path = view.settings().get('dired_path')
+            if path:
+                register(view, path)
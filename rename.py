@@ -0,0 +1,212 @@
+"""
+Applies the renames made in rename mode.
+
+The original names are kept here while a view is in rename mode.  When the edits are
+committed, `plan` orders the renames so no file is overwritten: chains like a->b, b->c are
+renamed from the end, and each cycle like x->y, y->x is broken with a single temporary name.
+`apply` performs the plan, keeping a journal so it can undo the renames already made if one
+fails.
+
+`substitute` computes renames from a pattern instead of edits, for dired_rename_pattern.
+"""
+
+import os, re
+from os.path import join, lexists, splitext, split
+
+from sublime_plugin import EventListener
+
+originals = {}
+# Map from the id of a view in rename mode to the names it showed when rename mode started.
+
+
+class RenameError(Exception):
+    pass
+
+
+def plan(renames, temp_name):
+    """
+    Returns the (old, new) steps that carry out `renames`, a list of (old, new) names where
+    no two old names and no two new names are the same.  Names can be relative paths into
+    subdirectories, in which case each file must stay in its directory.
+
+    temp_name
+        A function returning an unused name in the directory of the name passed to it, called
+        once per cycle.
+    """
+    new_names = dict(renames)
+    by_new    = { new: old for (old, new) in renames }
+    steps = []
+    done  = set()
+
+    def unwind(old):
+        # The name `old` is moving to is free, so rename it, then whatever is moving to `old`.
+        while old is not None and old not in done:
+            steps.append((old, new_names[old]))
+            done.add(old)
+            old = by_new.get(old)
+
+    for old, new in renames:
+        if new not in new_names:
+            unwind(old)
+
+    # Everything left is part of a cycle.
+    for old, new in renames:
+        if old not in done:
+            tmp = temp_name(old)
+            steps.append((old, tmp))
+            done.add(old)
+            unwind(by_new.get(old))
+            steps.append((tmp, new))
+
+    return steps
+
+
+def apply(path, renames):
+    """
+    Renames files in the directory `path`.  See `plan`.
+
+    Raises RenameError if a new name is already used by a file that isn't being renamed, or
+    if a rename fails.  In the latter case the renames already made are undone first.
+    """
+    sources = set(old for (old, new) in renames)
+    for old, new in renames:
+        if new not in sources and lexists(join(path, new)) and not _same(path, old, new):
+            raise RenameError('{} already exists'.format(new))
+
+    counter = [ 0 ]
+    def temp_name(old):
+        while True:
+            counter[0] += 1
+            name = join(split(old)[0], '.dired-rename-{}-{}'.format(os.getpid(), counter[0]))
+            if name not in sources and not lexists(join(path, name)):
+                return name
+
+    # Rename the contents of subdirectories before the subdirectories themselves, while their
+    # paths are still valid.  Each directory is planned separately, since `plan` reorders the
+    # renames it is given.
+    groups = {}
+    for old, new in renames:
+        groups.setdefault(split(old)[0], []).append((old, new))
+    steps = []
+    def depth(parent):
+        return parent and parent.count(os.sep) + 1 or 0
+    for parent in sorted(groups, key=depth, reverse=True):
+        steps.extend(plan(groups[parent], temp_name))
+
+    journal = []
+    # The steps completed so far, in order.
+
+    for old, new in steps:
+        try:
+            os.rename(join(path, old), join(path, new))
+        except OSError as e:
+            failed = rollback(path, journal)
+            msg = 'Unable to rename {} to {}: {}'.format(old, new, e.strerror)
+            if failed:
+                msg += '\n\nThese could not be undone:\n' + '\n'.join(
+                    '{} -> {}'.format(n, o) for (o, n) in failed)
+            raise RenameError(msg)
+        journal.append((old, new))
+
+
+def substitute(names, pattern, replacement, start=1):
+    """
+    Returns the (old, new) renames made by applying `pattern` to each of `names`.  Names that
+    don't match or don't change are left out.  Only the last part of names in subdirectories
+    is changed.
+
+    If `replacement` contains a '{' it is a format template that replaces the first match.
+    The template can use the match's groups as {0}, {1}, ... and {name}, {stem} and {ext}
+    for the old name, and {n} for a counter that starts at `start` and counts the matching
+    names (e.g. '{n:03}_{name}').  Otherwise it is a re.sub replacement (e.g. r'\\1.txt').
+
+    Raises RenameError if the pattern or replacement is invalid.  Use `check` to make sure the
+    new names are usable.
+    """
+    try:
+        regex = re.compile(pattern)
+    except re.error as e:
+        raise RenameError('Invalid pattern: {}'.format(e))
+
+    template = '{' in replacement
+    n = start
+
+    renames = []
+    try:
+        for path in names:
+            parent, name = split(path)
+            match = regex.search(name)
+            if not match:
+                continue
+            if template:
+                stem, ext = splitext(name)
+                text = replacement.format(*match.groups(), n=n, name=name, stem=stem, ext=ext)
+                new = name[:match.start()] + text + name[match.end():]
+                n += 1
+            else:
+                new = regex.sub(replacement, name)
+            if new != name:
+                renames.append((path, join(parent, new)))
+    except (re.error, IndexError, KeyError, ValueError) as e:
+        raise RenameError('Invalid replacement: {}'.format(e))
+
+    return renames
+
+
+def check(names, renames):
+    """
+    Raises RenameError if the (old, new) `renames` of files in `names` would give two files the
+    same name or produce an invalid name.
+    """
+    final = set(names)
+    final.difference_update(old for (old, new) in renames)
+    for old, new in renames:
+        parent, name = split(new)
+        if (not name or name in ('.', '..') or parent != split(old)[0] or
+                (os.altsep and os.altsep in name)):
+            raise RenameError('Invalid name for {}: {!r}'.format(old, new))
+        if new in final:
+            raise RenameError('{} would be renamed to {}, which is already used'.format(old, new))
+        final.add(new)
+
+
+def preview(renames, limit=10):
+    """
+    Returns a summary of `renames` showing the first `limit` of them.
+    """
+    lines = [ '{} -> {}'.format(old, new) for (old, new) in renames[:limit] ]
+    if len(renames) > limit:
+        lines.append('... and {} more'.format(len(renames) - limit))
+    return '\n'.join(lines)
+
+
+def rollback(path, journal):
+    """
+    Undoes the renames in `journal`, most recent first.  Returns the steps that could not be
+    undone.
+    """
+    failed = []
+    for old, new in reversed(journal):
+        try:
+            os.rename(join(path, new), join(path, old))
+        except OSError:
+            failed.append((old, new))
+    return failed
+
+
+def _same(path, old, new):
+    """
+    Returns True if `old` and `new` are the same file, which happens when changing the case
+    of a name on a case-insensitive filesystem.
+    """
+    try:
+        a = os.lstat(join(path, old))
+        b = os.lstat(join(path, new))
+    except OSError:
+        return False
+    return (a.st_dev, a.st_ino) == (b.st_dev, b.st_ino)
+
+
+class DiredRenameEventListener(EventListener):
+    def on_close(self, view):
+        originals.pop(view.id(), None)
@@ -0,0 +1,94 @@
+"""
+Helpers for turning directory listings into view contents.
+"""
+
+import os
+
+
+def sort_key(name):
+    return (name.lower(), name)
+
+
+def sort_entries(entries):
+    """
+    Returns a new list of the entries in display order.
+    """
+    return sorted(entries, key=lambda entry: sort_key(entry.name))
+
+
+def find(entries, name):
+    """
+    Returns the index of the entry named `name` in `entries`, which must be in display order,
+    or None if there isn't one.
+    """
+    key = sort_key(name)
+    lo, hi = 0, len(entries)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if sort_key(entries[mid].name) < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < len(entries) and entries[lo].name == name:
+        return lo
+    return None
+
+
+def line_key(line):
+    return sort_key(line.rstrip(os.sep))
+
+
+def diff(old, new, limit=None, key=line_key):
+    """
+    Compares two sorted lists of display lines and returns the edits needed to turn `old`
+    into `new` as a list of hunks `(start, end, lines)`: old[start:end] is replaced by `lines`.
+    The hunks are in order and do not overlap.
+
+    Returns None if `old` is not in display order (so it cannot be merged) or if more than
+    `limit` lines change, in which case it is cheaper to replace everything.
+
+    key
+        Returns the sort key of an item.  By default the items are lines of names.
+    """
+    keys = [ key(line) for line in old ]
+    if any(keys[i] >= keys[i+1] for i in range(len(keys) - 1)):
+        return None
+
+    hunks = []
+    changed = 0
+    start = None
+    lines = []
+    i = j = 0
+
+    while i < len(old) or j < len(new):
+        if i < len(old) and j < len(new) and old[i] == new[j]:
+            if start is not None:
+                hunks.append((start, i, lines))
+                start = None
+                lines = []
+            i += 1
+            j += 1
+            continue
+
+        if start is None:
+            start = i
+
+        newkey = j < len(new) and key(new[j])
+        if i < len(old) and (j == len(new) or keys[i] <= newkey):
+            if keys[i] == newkey:
+                # Same name, different type (e.g. a file replaced by a directory).
+                lines.append(new[j])
+                j += 1
+            i += 1
+        else:
+            lines.append(new[j])
+            j += 1
+
+        changed += 1
+        if limit is not None and changed > limit:
+            return None
+
+    if start is not None:
+        hunks.append((start, i, lines))
+
+    return hunks
@@ -0,0 +1,225 @@
+"""
+Directory scanning.
+
+Listings are read with os.scandir so the file type comes from the directory entry itself
+instead of a stat per name, and scans run on a worker thread so large or slow (NFS)
+directories don't freeze the UI.
+"""
+
+import os, threading
+from os.path import join, isdir, islink
+
+import sublime
+
+_scandir = getattr(os, 'scandir', None)
+# os.scandir is only available in Python 3.5+.  Older plugin hosts fall back to listdir.
+
+CHECK_EVERY = 1000
+# How many entries are read between checks for cancellation.
+
+
+class ScanCancelled(Exception):
+    pass
+
+
+class Entry:
+    """
+    A single directory entry.
+    """
+    __slots__ = ('name', 'is_dir', 'is_link', 'ino', 'st', 'target', 'keys')
+
+    def __init__(self, name, is_dir, is_link=False, ino=0):
+        self.name    = name
+        self.is_dir  = is_dir
+        self.is_link = is_link
+        self.ino     = ino
+
+        self.st = None
+        # The entry's lstat result, filled in by stat_entries on a worker thread when a
+        # display mode needs it, or False if the file could not be stat'ed.
+
+        self.target = None
+        # For symlinks, the link's target once the long format has looked it up.
+
+        self.keys = None
+        # Map from sort order to this entry's key, filled in by order.key.
+
+    @property
+    def text(self):
+        """
+        The text displayed for the entry: the name with a trailing separator for directories.
+        """
+        return self.is_dir and (self.name + os.sep) or self.name
+
+    def __repr__(self):
+        return 'Entry({!r})'.format(self.text)
+
+
+def from_direntry(de):
+    try:
+        # is_dir follows symlinks like isdir does, but only needs a stat for the links
+        # themselves.  Everything else is answered from d_type.
+        is_dir = de.is_dir()
+    except OSError:
+        is_dir = False
+    try:
+        is_link = de.is_symlink()
+    except OSError:
+        is_link = False
+    return Entry(de.name, is_dir, is_link, de.inode())
+
+
+def scan(path, cancelled=None):
+    """
+    Returns a list of Entry objects for the directory `path` in the order the filesystem
+    returns them.
+
+    cancelled
+        An optional function called periodically.  If it returns True the scan is abandoned
+        and ScanCancelled is raised.
+    """
+    entries = []
+
+    if _scandir is None:
+        it = ( Entry(name, isdir(join(path, name)), islink(join(path, name))) for name in os.listdir(path) )
+    else:
+        it = ( from_direntry(de) for de in _scandir(path) )
+
+    for entry in it:
+        entries.append(entry)
+        if cancelled and len(entries) % CHECK_EVERY == 0 and cancelled():
+            raise ScanCancelled()
+
+    return entries
+
+
+def stat_entries(path, entries, cancelled=None):
+    """
+    Fills in the `st` attribute of each entry of the directory `path` that doesn't have it yet.
+    This is an lstat per file, so it is slow for large directories and should be run on a
+    worker thread: see Scanner.start and stat_async.
+
+    Entries are shared through the listing cache, so each file is only stat'ed once per scan
+    of its directory.  Sizes and times are as of then until the directory is read again,
+    either because it changed or because the view was refreshed explicitly.
+
+    cancelled
+        As for scan.
+    """
+    for i, entry in enumerate(entries):
+        if entry.st is None:
+            try:
+                entry.st = os.lstat(join(path, entry.name))
+            except OSError:
+                entry.st = False
+        if cancelled and i % CHECK_EVERY == 0 and cancelled():
+            raise ScanCancelled()
+
+
+def stat_async(path, entries, callback):
+    """
+    Runs stat_entries on a worker thread, then calls `callback()` on the main thread.
+    """
+    entries = list(entries)
+
+    def _run():
+        stat_entries(path, entries)
+        sublime.set_timeout(callback, 0)
+
+    sublime.set_timeout_async(_run, 0)
+
+
+class Scanner:
+    """
+    Runs scans on worker threads.
+
+    Each caller identifies itself with a key (normally a view id) and has at most one scan
+    outstanding.  Callers asking for the same directory share a single scan, unless only some
+    of them want the entries stat'ed.  Starting a new scan for a key detaches it from its
+    previous one, and a scan nobody is waiting for any more stops at its next cancellation
+    check.
+    """
+    def __init__(self, load):
+        self.load = load
+        # The function used to produce the entries: `load(path, cancelled)` returns the
+        # entries and a stamp identifying the version of the directory read.
+
+        self.lock = threading.Lock()
+        self.jobs = {}
+        # Map from (path, stat) to the _Job scanning it.
+
+        self.keys = {}
+        # Map from key to the (path, stat) it is waiting on.
+
+    def start(self, key, path, callback, stat=False):
+        """
+        Scans `path` on a worker thread and calls `callback(entries, error, stamp)` on the
+        main thread.  On success error is None; if the directory could not be read entries
+        and stamp are None and error is the OSError.
+
+        stat
+            Also fill in the entries' lstat data (see stat_entries) before calling back.
+        """
+        with self.lock:
+            self._detach(key)
+            job = self.jobs.get((path, stat))
+            if job is None:
+                job = self.jobs[(path, stat)] = _Job(path, stat)
+                thread = threading.Thread(target=self._run, args=(job,), name='dired-scan')
+                thread.daemon = True
+                thread.start()
+            job.waiters[key] = callback
+            self.keys[key] = (path, stat)
+
+    def cancel(self, key):
+        """
+        Abandons any scan `key` is waiting on, and those of the tuple keys starting with `key`
+        (e.g. a view's subdirectories).
+        """
+        with self.lock:
+            for other in list(self.keys):
+                if other == key or (isinstance(other, tuple) and other[0] == key):
+                    self._detach(other)
+
+    def _detach(self, key):
+        item = self.keys.pop(key, None)
+        job = item and self.jobs.get(item)
+        if job:
+            job.waiters.pop(key, None)
+            if not job.waiters:
+                job.cancelled = True
+                del self.jobs[item]
+
+    def _run(self, job):
+        entries = error = current = None
+        cancelled = lambda: job.cancelled
+        try:
+            entries, current = self.load(job.path, cancelled)
+            if job.stat:
+                stat_entries(job.path, entries, cancelled)
+        except ScanCancelled:
+            return
+        except OSError as e:
+            error = e
+        sublime.set_timeout(lambda: self._done(job, entries, error, current), 0)
+
+    def _done(self, job, entries, error, current):
+        with self.lock:
+            item = (job.path, job.stat)
+            if self.jobs.get(item) is not job:
+                return
+            del self.jobs[item]
+            for key in job.waiters:
+                del self.keys[key]
+        for callback in job.waiters.values():
+            callback(entries, error, current)
+
+
+class _Job:
+    __slots__ = ('path', 'stat', 'waiters', 'cancelled')
+
+    def __init__(self, path, stat):
+        self.path      = path
+        self.stat      = stat
+        self.waiters   = {}
+        self.cancelled = False
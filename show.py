@@ -1,11 +1,18 @@
 
 import os
 from os.path import basename
-from .common import first
+from . import registry, history
 
-def show(window, path, view_id=None, ignore_existing=False, goto=None):
+INHERITED = ('dired_long', 'dired_du', 'dired_sort', 'dired_sort_reverse', 'dired_dirs_first')
+# View settings copied by `inherit`.
+
+
+def show(window, path, view_id=None, ignore_existing=False, goto=None, inherit=None):
     """
     Determines the correct view to use, creating one if necessary, and prepares it.
+
+    inherit
+        An optional dired view whose display modes (long format, disk usage) are used.
     """
     if not path.endswith(os.sep):
         path += os.sep
@@ -14,18 +21,35 @@ def show(window, path, view_id=None, ignore_existing=False, goto=None):
     if view_id:
         # The Goto command was used so the view is already known and its contents should be
         # replaced with the new path.
-        view = first(window.views(), lambda v: v.id() == view_id)
+        view = registry.get(window, view_id)
 
     if not view and not ignore_existing:
         # See if a view for this path already exists.
-        view = first(window.views(), lambda v: v.settings().get('dired_path') == path)
+        view = registry.find(window, path, lambda v: not v.settings().get('dired_find'))
+
+    if view and view.settings().get('dired_path') not in (None, path):
+        if history.peek(view) == path:
+            # Going back to where the view came from, e.g. up after opening a subdirectory.
+            window.focus_view(view)
+            view.run_command('dired_history')
+            return
+        history.push(view)
 
-    if not view:
+    created = not view
+    if created:
         view = window.new_file()
         view.set_scratch(True)
 
     view.set_name(basename(path.rstrip(os.sep)))
     view.settings().set('dired_path', path)
     view.settings().set('dired_rename_mode', False)
+    view.settings().erase('dired_find')
+    registry.register(view, path)
+    if inherit and inherit != view:
+        for key in INHERITED:
+            if inherit.settings().has(key):
+                view.settings().set(key, inherit.settings().get(key))
     window.focus_view(view)
+    if created:
+        registry.trim(window, view)
     view.run_command('dired_refresh', { 'goto': goto })
@@ -0,0 +1,36 @@
+"""
+Loads the plugin's modules outside Sublime Text.
+
+At import time the modules only need the sublime and sublime_plugin APIs for base classes, so
+placeholder modules stand in for them.  The package is imported as `dired`, the name Sublime
+Text gives it.
+"""
+
+import sys, types, importlib
+from os.path import dirname, abspath
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def _placeholders():
+    if 'sublime' not in sys.modules:
+        sublime = types.ModuleType('sublime')
+        sublime.Region = object
+        sys.modules['sublime'] = sublime
+    if 'sublime_plugin' not in sys.modules:
+        plugin = types.ModuleType('sublime_plugin')
+        for name in ('EventListener', 'ViewEventListener', 'TextCommand', 'WindowCommand'):
+            setattr(plugin, name, object)
+        sys.modules['sublime_plugin'] = plugin
+
+
+def load(name):
+    """
+    Returns the plugin module `name`, e.g. 'fileops'.
+    """
+    _placeholders()
+    if 'dired' not in sys.modules:
+        package = types.ModuleType('dired')
+        package.__path__ = [ ROOT ]
+        sys.modules['dired'] = package
+    return importlib.import_module('dired.' + name)
@@ -0,0 +1,90 @@
+"""
+Tests for fileops.py.  Run from the package directory with `python -m unittest discover tests`.
+"""
+
+import errno, os, shutil, tempfile, unittest
+from unittest import mock
+try:
+    import resource
+except ImportError:
+    resource = None
+from os.path import join, exists, lexists
+
+from support import load
+
+fileops = load('fileops')
+jobs = load('jobs')
+
+
+class DeleteTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def delete_link(self, workers):
+        # Entries name directories, including symlinks to them, with a trailing separator.
+        target = join(self.path, 'target')
+        os.mkdir(target)
+        open(join(target, 'file'), 'w').close()
+        link = join(self.path, 'link')
+        os.symlink(target, link)
+
+        fileops.delete(jobs.Job('delete', [], None), [ link + os.sep ], workers)
+
+        self.assertFalse(lexists(link))
+        self.assertTrue(exists(join(target, 'file')))
+
+    def test_link(self):
+        self.delete_link(1)
+
+    def test_link_parallel(self):
+        self.delete_link(4)
+
+    @unittest.skipUnless(resource and fileops._parallel_delete, 'needs the parallel delete')
+    def test_wide_tree(self):
+        # More directories than descriptors, each with a file so none are finished early.
+        tree = join(self.path, 'tree')
+        for i in range(600):
+            os.makedirs(join(tree, str(i)))
+            open(join(tree, str(i), 'file'), 'w').close()
+
+        limits = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (256, limits[1]))
+        try:
+            fileops.ParallelDelete(jobs.Job('delete', [], None), tree, 4).run()
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, limits)
+        self.assertFalse(exists(tree))
+
+
+class MoveTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_cross_device_rename(self):
+        # A bind mount can have the target's device number and still refuse the rename.
+        src = join(self.path, 'src')
+        os.makedirs(join(src, 'dir'))
+        with open(join(src, 'dir', 'file'), 'w') as f:
+            f.write('data')
+        target = join(self.path, 'target')
+        os.mkdir(target)
+
+        def rename(src, dst):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV), src)
+
+        with mock.patch.object(fileops.os, 'rename', rename):
+            fileops.move(jobs.Job('move', [], None), [ join(src, 'dir') + os.sep ], target)
+
+        self.assertFalse(exists(join(src, 'dir')))
+        with open(join(target, 'dir', 'file')) as f:
+            self.assertEqual(f.read(), 'data')
+
+
+if __name__ == '__main__':
+    unittest.main()
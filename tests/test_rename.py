@@ -0,0 +1,48 @@
+"""
+Tests for rename.py.  Run from the package directory with `python -m unittest discover tests`.
+"""
+
+import os, shutil, tempfile, unittest
+from os.path import join
+
+from support import load
+
+rename = load('rename')
+
+
+class ApplyTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name):
+        with open(join(self.path, name), 'w') as f:
+            f.write(name)
+
+    def read(self, name):
+        with open(join(self.path, name)) as f:
+            return f.read()
+
+    def test_cycle(self):
+        for name in 'abc':
+            self.write(name)
+        rename.apply(self.path, [ ('a', 'b'), ('b', 'c'), ('c', 'a') ])
+        self.assertEqual([ self.read(name) for name in 'abc' ], [ 'c', 'a', 'b' ])
+
+    def test_cycle_in_renamed_directory(self):
+        # The cycle inside `a` must be done before `a` itself is renamed.
+        os.mkdir(join(self.path, 'a'))
+        self.write(join('a', 'x'))
+        self.write(join('a', 'y'))
+        rename.apply(self.path, [ (join('a', 'x'), join('a', 'y')),
+                                  (join('a', 'y'), join('a', 'x')),
+                                  ('a', 'b') ])
+        self.assertEqual(os.listdir(self.path), [ 'b' ])
+        self.assertEqual(self.read(join('b', 'x')), join('a', 'y'))
+        self.assertEqual(self.read(join('b', 'y')), join('a', 'x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,316 @@
+"""
+Automatically refreshes dired views when their directories change.
+
+On Linux the directories are watched with inotify (through ctypes).  Elsewhere, or if inotify
+is not available, the directories are polled.  Changes are coalesced so a burst of events,
+such as a build writing thousands of files, causes one refresh per window of time.  Views
+that are not visible are only flagged and are refreshed when they are next activated.
+"""
+
+import os, sys, threading, time, struct, select, ctypes, ctypes.util
+
+import sublime
+from sublime_plugin import EventListener
+
+from .cache import normalize, stamp
+
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_NONBLOCK    = 0x00000800
+IN_CLOEXEC     = 0x00080000
+
+WATCH_MASK = (IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+              IN_ONLYDIR)
+# Changes to a file's contents or attributes don't change its directory, so they aren't watched:
+# the listing is cached by directory mtime and a rescan wouldn't see them anyway.  Sizes and
+# times shown in long format and disk usage mode are updated by a manual refresh.
+
+EVENT = struct.Struct('iIII')
+# The fixed part of struct inotify_event: wd, mask, cookie, len.  `len` bytes of name follow.
+
+
+def settings():
+    return sublime.load_settings('dired.sublime-settings')
+
+
+class Inotify:
+    """
+    A minimal inotify wrapper.  Raises OSError from the constructor if inotify is not
+    available.
+    """
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = [ ctypes.c_int, ctypes.c_int ]
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add(self, path):
+        wd = self._add(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def remove(self, wd):
+        self._rm(self.fd, wd)
+
+    def read(self, timeout):
+        """
+        Waits up to `timeout` seconds for events and returns a list of (wd, mask) tuples.
+        """
+        ready, _, _ = select.select([ self.fd ], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            events.append((wd, mask))
+            offset += EVENT.size + length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Tracks the directory displayed by each dired view and refreshes the views when the
+    directories change.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.views = {}
+        # Map from view id to the normalized path it displays.
+
+        self.paths = {}
+        # Map from normalized path to the set of view ids displaying it.
+
+        self.wds   = {}
+        self.by_wd = {}
+        # Map from normalized path to inotify watch descriptor and back.  Unused when polling.
+
+        self.stamps = {}
+        # Map from normalized path to its last stamp.  Only used when polling.
+
+        self.dirty = set()
+        # Normalized paths that changed and have not been flushed.
+
+        self.flush_scheduled = False
+        self.inotify = None
+        self.thread  = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        try:
+            self.inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            # AttributeError: libc has no inotify functions.
+            print('dired: inotify unavailable, polling for changes:', e)
+            self.inotify = None
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='dired-watch')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(2)
+            self.thread = None
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        self.views.clear()
+        self.paths.clear()
+        self.wds.clear()
+        self.by_wd.clear()
+        self.stamps.clear()
+
+    def watch(self, view_id, path):
+        """
+        Records that the view `view_id` is displaying `path`, replacing anything it displayed
+        before.
+        """
+        if not self.running:
+            return
+        path = normalize(path)
+        with self.lock:
+            if self.views.get(view_id) == path:
+                return
+            self._unwatch(view_id)
+            self.views[view_id] = path
+            if path in self.paths:
+                self.paths[path].add(view_id)
+                return
+            self.paths[path] = { view_id }
+
+            if self.inotify:
+                try:
+                    wd = self.inotify.add(path)
+                    self.wds[path] = wd
+                    self.by_wd[wd] = path
+                except OSError as e:
+                    print('dired: unable to watch', path, e)
+            else:
+                try:
+                    self.stamps[path] = stamp(path)
+                except OSError:
+                    self.stamps[path] = None
+
+    def unwatch(self, view_id):
+        with self.lock:
+            self._unwatch(view_id)
+
+    def _unwatch(self, view_id):
+        path = self.views.pop(view_id, None)
+        if path is None:
+            return
+        ids = self.paths[path]
+        ids.discard(view_id)
+        if ids:
+            return
+        del self.paths[path]
+        self.stamps.pop(path, None)
+        wd = self.wds.pop(path, None)
+        if wd is not None:
+            del self.by_wd[wd]
+            self.inotify.remove(wd)
+
+    def _run(self):
+        while self.running:
+            if self.inotify:
+                changed = self._read_inotify()
+            else:
+                changed = self._poll()
+            if changed:
+                self._changed(changed)
+
+    def _read_inotify(self):
+        changed = set()
+        for wd, mask in self.inotify.read(0.5):
+            with self.lock:
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped, so we don't know what changed.
+                    changed.update(self.paths)
+                elif not mask & IN_IGNORED:
+                    path = self.by_wd.get(wd)
+                    if path:
+                        changed.add(path)
+        return changed
+
+    def _poll(self):
+        interval = settings().get('auto_refresh_poll_seconds', 2)
+        for _ in range(int(interval / 0.25) or 1):
+            if not self.running:
+                return None
+            time.sleep(0.25)
+
+        with self.lock:
+            paths = list(self.stamps)
+
+        changed = set()
+        for path in paths:
+            try:
+                current = stamp(path)
+            except OSError:
+                current = None
+            with self.lock:
+                if path in self.stamps and self.stamps[path] != current:
+                    self.stamps[path] = current
+                    changed.add(path)
+        return changed
+
+    def _changed(self, paths):
+        with self.lock:
+            self.dirty.update(paths)
+            if self.flush_scheduled:
+                return
+            self.flush_scheduled = True
+        sublime.set_timeout(self._flush, settings().get('auto_refresh_delay_ms', 500))
+
+    def _flush(self):
+        """
+        Refreshes the visible views for every changed path and flags the others.  Called on
+        the main thread once per coalescing window.
+        """
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = set()
+            self.flush_scheduled = False
+            ids = [ view_id for path in dirty for view_id in self.paths.get(path, ()) ]
+
+        for view_id in ids:
+            view = sublime.View(view_id)
+            if not view.is_valid():
+                self.unwatch(view_id)
+            elif is_visible(view):
+                refresh(view)
+            else:
+                view.settings().set('dired_stale', True)
+
+
+watcher = Watcher()
+
+
+def is_visible(view):
+    window = view.window()
+    if not window:
+        return False
+    group, _ = window.get_view_index(view)
+    return window.active_view_in_group(group) == view
+
+
+def refresh(view):
+    view.settings().erase('dired_stale')
+    if not view.settings().get('dired_rename_mode'):
+        view.run_command('dired_refresh')
+
+
+class DiredWatchEventListener(EventListener):
+    def on_activated(self, view):
+        if view.settings().get('dired_stale'):
+            refresh(view)
+
+    def on_close(self, view):
+        if view.settings().has('dired_path'):
+            watcher.unwatch(view.id())
+
+
+def plugin_loaded():
+    if not settings().get('auto_refresh', True):
+        return
+    watcher.start()
+
+    # Views restored from the last session have their contents but nothing is watching them.
+    for window in sublime.windows():
+        for view in window.views():
+            path = view.settings().get('dired_path')
+            if path:
+                watcher.watch(view.id(), path)
+
+
+def plugin_unloaded():
+    watcher.stop()